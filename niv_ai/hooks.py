@@ -51,6 +51,10 @@ doc_events = {
     "Niv Conversation": {
         "after_insert": "niv_ai.niv_core.doctype.niv_conversation.niv_conversation.after_insert",
     },
+    "User": {
+        "on_update": "niv_ai.niv_core.api.mobile.evict_user_token",
+        "on_trash": "niv_ai.niv_core.api.mobile.evict_user_token",
+    },
     "*": {
         "before_save": "niv_ai.niv_core.api.automation.on_doc_event",
         "on_update": "niv_ai.niv_core.api.automation.on_doc_event",
@@ -10,6 +10,7 @@ def after_install():
     _seed_default_prompts()
     _seed_default_plans()
     frappe.db.commit()
+    _ensure_db_indexes()
     _preload_piper_voice()
     _run_auto_discovery()
     _optimize_mariadb()
@@ -60,6 +61,7 @@ def after_migrate():
     _create_settings()
     _ensure_settings_defaults()
     frappe.db.commit()
+    _ensure_db_indexes()
     _run_auto_discovery()
 
 
@@ -189,6 +191,35 @@ def _seed_default_plans():
     print(f"  → {len(DEFAULT_PLANS)} default credit plans created")
 
 
+# Composite indexes backing hot filters. Niv Pairing Code.code and
+# User.api_key are unique fields, so they're indexed already.
+_DB_INDEXES = [
+    ("Niv Shared Chat", ["conversation", "shared_by"]),
+    # History loads and get_messages
+    ("Niv Message", ["conversation", "creation"]),
+    # Per-user message counts by role over a time range
+    ("Niv Message", ["owner", "role", "creation"]),
+]
+
+
+def _ensure_db_indexes():
+    """Add indexes that DocType JSON can't express (runs on every migrate)."""
+    try:
+        if frappe.db.db_type == "mariadb" and not frappe.db.has_index(
+            "tabNiv Message", "ft_niv_message_content"
+        ):
+            frappe.db.sql_ddl(
+                "ALTER TABLE `tabNiv Message` ADD FULLTEXT INDEX ft_niv_message_content (content)"
+            )
+            frappe.cache().delete_value("niv_ai:message_fulltext")
+            print("  → FULLTEXT index added on Niv Message content")
+
+        for doctype, fields in _DB_INDEXES:
+            frappe.db.add_index(doctype, fields)
+    except Exception as e:
+        print(f"  → Index setup skipped: {e}")
+
+
 def _run_auto_discovery():
     """Run auto-discovery to scan and learn the system."""
     try:
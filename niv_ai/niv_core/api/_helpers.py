@@ -2,9 +2,9 @@
 Shared helpers for chat + stream API endpoints.
 DRY — no duplicate logic.
 """
+import hashlib
 import json
 import frappe
-from datetime import datetime, timedelta
 
 
 # ─── Per-User API Key for MCP Permission Isolation ─────────────────
@@ -75,18 +75,8 @@ def validate_conversation(conversation_id: str, user: str):
         frappe.throw("Access denied", frappe.PermissionError)
 
 
-def save_user_message(conversation_id: str, message: str, dedup: bool = False):
-    """Save user message to Niv Message. Optional 30s dedup."""
-    if dedup:
-        cutoff = (datetime.now() - timedelta(seconds=30)).strftime("%Y-%m-%d %H:%M:%S")
-        if frappe.db.exists("Niv Message", {
-            "conversation": conversation_id,
-            "role": "user",
-            "content": message,
-            "creation": (">", cutoff),
-        }):
-            return  # Already saved (e.g., by stream retry)
-
+def save_user_message(conversation_id: str, message: str):
+    """Save user message to Niv Message."""
     frappe.get_doc({
         "doctype": "Niv Message",
         "conversation": conversation_id,
@@ -121,16 +111,119 @@ def save_assistant_message(conversation_id: str, content: str, tool_calls: list
         frappe.log_error(f"Save assistant message error: {e}", "Niv AI")
 
 
+def claim_user_message(conversation_id: str, message: str, window: int = 30) -> bool:
+    """Mark a user message as accepted. False if the same message was already
+    accepted for this conversation in the last `window` seconds (stream retry)."""
+    digest = hashlib.sha1(message.encode("utf-8")).hexdigest()
+    try:
+        cache = frappe.cache()
+        key = cache.make_key(f"niv_ai:msg_dedup:{conversation_id}:{digest}")
+        return bool(cache.set(key, 1, nx=True, ex=window))
+    except Exception:
+        return True
+
+
+def save_turn(conversation_id: str, user_message: str = None, user_message_at=None,
+              user: str = None, content: str = "", tool_calls: list = None,
+              input_tokens: int = 0, output_tokens: int = 0, total_tokens: int = 0,
+              model: str = None, raise_exception: bool = False):
+    """Save one chat turn (optional user message + assistant reply) and the
+    untitled-conversation title, then commit once.
+
+    Rows go through the Niv Message controller, so conversation stats and
+    doc_events (auto actions, triggers) run as for any other insert.
+    Nothing is committed on failure, so a caller passing
+    raise_exception=True can reconnect and retry.
+    """
+    try:
+        if user_message is not None:
+            user_doc = frappe.get_doc({
+                "doctype": "Niv Message",
+                "conversation": conversation_id,
+                "role": "user",
+                "content": user_message,
+            }).insert(ignore_permissions=True)
+            # insert() stamps owner/creation from the session and clock;
+            # keep the sender and the time the message was accepted
+            fixup = {}
+            if user and user_doc.owner != user:
+                fixup.update({"owner": user, "modified_by": user})
+            if user_message_at:
+                fixup.update({"creation": user_message_at, "modified": user_message_at})
+            if fixup:
+                frappe.db.set_value("Niv Message", user_doc.name, fixup, update_modified=False)
+
+        msg_data = {
+            "doctype": "Niv Message",
+            "conversation": conversation_id,
+            "role": "assistant",
+            "content": content or "",
+            "input_tokens": input_tokens or 0,
+            "output_tokens": output_tokens or 0,
+            "total_tokens": total_tokens or 0,
+        }
+        if model:
+            msg_data["model"] = model
+        if tool_calls:
+            msg_data["tool_calls_json"] = json.dumps(tool_calls, default=str)
+        frappe.get_doc(msg_data).insert(ignore_permissions=True)
+
+        if user_message:
+            _apply_auto_title(conversation_id, user_message)
+        frappe.db.commit()
+    except Exception as e:
+        try:
+            frappe.db.rollback()
+        except Exception:
+            pass
+        if raise_exception:
+            raise
+        frappe.log_error(f"Save chat turn error: {e}", "Niv AI")
+
+
+def _apply_auto_title(conversation_id: str, message: str):
+    """Title an untitled conversation from its first user message (no commit)."""
+    current = frappe.db.get_value("Niv Conversation", conversation_id, "title")
+    if current and not current.startswith("New Chat"):
+        return
+    title = message[:80].strip()
+    if len(message) > 80:
+        title += "..."
+    conv = frappe.get_doc("Niv Conversation", conversation_id)
+    conv.title = title
+    conv.save(ignore_permissions=True)
+
+
 def auto_title(conversation_id: str, message: str):
     """Set conversation title from first user message if untitled."""
     try:
-        conv = frappe.get_doc("Niv Conversation", conversation_id)
-        if not conv.title or conv.title.startswith("New Chat"):
-            title = message[:80].strip()
-            if len(message) > 80:
-                title += "..."
-            conv.title = title
-            conv.save(ignore_permissions=True)
-            frappe.db.commit()
+        _apply_auto_title(conversation_id, message)
+        frappe.db.commit()
     except Exception:
         pass
+
+
+def chunk_text(text: str, limit: int) -> list:
+    """Split text on line boundaries into chunks of at most ``limit`` chars
+    (a single longer line becomes its own chunk). Used by the messaging
+    channels, which cap message length.
+    """
+    # Collect each chunk's lines and join once — no quadratic string growth
+    chunks = []
+    parts = []
+    size = 0  # len("\n".join(parts))
+    for line in text.split("\n"):
+        if size + len(line) + 1 > limit:
+            if size:
+                chunks.append("\n".join(parts))
+            parts = [line]
+            size = len(line)
+        elif size:
+            parts.append(line)
+            size += len(line) + 1
+        else:
+            parts = [line]
+            size = len(line)
+    if size:
+        chunks.append("\n".join(parts))
+    return chunks
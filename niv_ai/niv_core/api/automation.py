@@ -11,6 +11,18 @@ class DateTimeEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+def _dumps_prefix(obj, limit):
+    """json.dumps(obj, indent=2)[:limit] without serializing past the limit."""
+    parts = []
+    size = 0
+    for chunk in DateTimeEncoder(indent=2).iterencode(obj):
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            break
+    return "".join(parts)[:limit]
+
+
 def _safe_log_error(title, message):
     """Best-effort logger that won't recurse/crash hook execution."""
     try:
@@ -130,7 +142,7 @@ def execute_auto_action(action_name, doctype, docname):
         },
         {
             "role": "user",
-            "content": f"{prompt}\n\nDocument data:\n```json\n{json.dumps(clean_data, cls=DateTimeEncoder, indent=2)[:4000]}\n```",
+            "content": f"{prompt}\n\nDocument data:\n```json\n{_dumps_prefix(clean_data, 4000)}\n```",
         },
     ]
 
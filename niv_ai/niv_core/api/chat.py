@@ -32,16 +32,17 @@ def send_message(conversation_id, message, model=None, provider=None, attachment
     if parsed_attachments and not len(parsed_attachments):
         parsed_attachments = None
 
-    validate_conversation(conversation_id, user)
+    # Resolve provider/model once
+    settings = get_niv_settings()
 
-    # Rate limiting
+    # Rate limiting (Redis only) before any DB work
     from niv_ai.niv_core.api.stream import _check_rate_limit
-    _check_rate_limit(user)
+    _check_rate_limit(user, settings)
+
+    validate_conversation(conversation_id, user)
 
     save_user_message(conversation_id, message)
 
-    # Resolve provider/model once
-    settings = get_niv_settings()
     provider = provider or settings.default_provider
     model = model or settings.default_model
 
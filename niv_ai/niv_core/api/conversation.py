@@ -1,5 +1,13 @@
+"""
+Conversation API — chat sessions, messages, reactions, pins and sharing.
+
+Write endpoints are POST-only and rely on Frappe committing the transaction
+when the request succeeds (GET requests are rolled back); only
+delete_conversation (several tables) commits explicitly.
+"""
 import frappe
 import json
+from niv_ai.niv_core.utils import get_niv_settings
 
 try:
     from niv_ai.niv_core.utils.validators import validate_model_name, validate_title
@@ -10,11 +18,11 @@ except ImportError:
     handle_errors = lambda f: f
 
 
-@frappe.whitelist(allow_guest=False)
+@frappe.whitelist(allow_guest=False, methods=["POST"])
 def create_conversation(title=None, system_prompt=None, model=None, provider=None):
     """Create a new chat session"""
     user = frappe.session.user
-    settings = frappe.get_single("Niv Settings")
+    settings = get_niv_settings()
 
     title = validate_title(title)
     model = validate_model_name(model)
@@ -28,7 +36,6 @@ def create_conversation(title=None, system_prompt=None, model=None, provider=Non
         "system_prompt": system_prompt or settings.system_prompt,
     })
     doc.insert(ignore_permissions=True)
-    frappe.db.commit()
 
     return {
         "name": doc.name,
@@ -124,7 +131,7 @@ def delete_conversation(conversation_id):
     return {"status": "ok"}
 
 
-@frappe.whitelist(allow_guest=False)
+@frappe.whitelist(allow_guest=False, methods=["POST"])
 def rename_conversation(conversation_id, title):
     """Rename a conversation"""
     user = frappe.session.user
@@ -133,11 +140,10 @@ def rename_conversation(conversation_id, title):
         frappe.throw("Not your conversation", frappe.PermissionError)
 
     frappe.db.set_value("Niv Conversation", conversation_id, "title", title)
-    frappe.db.commit()
     return {"status": "ok", "title": title}
 
 
-@frappe.whitelist(allow_guest=False)
+@frappe.whitelist(allow_guest=False, methods=["POST"])
 def archive_conversation(conversation_id):
     """Archive/unarchive a conversation"""
     user = frappe.session.user
@@ -147,7 +153,6 @@ def archive_conversation(conversation_id):
 
     new_val = 0 if conv.is_archived else 1
     frappe.db.set_value("Niv Conversation", conversation_id, "is_archived", new_val)
-    frappe.db.commit()
     return {"status": "ok", "is_archived": new_val}
 
 
@@ -206,7 +211,7 @@ def get_widget_config():
     }
 
 
-@frappe.whitelist(allow_guest=False)
+@frappe.whitelist(allow_guest=False, methods=["POST"])
 def toggle_reaction(message_id, emoji):
     """Toggle a reaction emoji on a message. Returns updated reactions dict."""
     user = frappe.session.user
@@ -236,12 +241,11 @@ def toggle_reaction(message_id, emoji):
         reactions[emoji].append(user)
 
     frappe.db.set_value("Niv Message", message_id, "reactions_json", json.dumps(reactions))
-    frappe.db.commit()
 
     return {"reactions": reactions}
 
 
-@frappe.whitelist(allow_guest=False)
+@frappe.whitelist(allow_guest=False, methods=["POST"])
 def toggle_pin(message_id):
     """Toggle pin status on a message"""
     user = frappe.session.user
@@ -252,59 +256,109 @@ def toggle_pin(message_id):
 
     new_val = 0 if msg.is_pinned else 1
     frappe.db.set_value("Niv Message", message_id, "is_pinned", new_val)
-    frappe.db.commit()
     return {"status": "ok", "is_pinned": new_val}
 
 
-@frappe.whitelist(allow_guest=False)
+@frappe.whitelist(allow_guest=False, methods=["POST"])
 def share_conversation(conversation_id):
     """Create a shareable link for a conversation"""
-    import hashlib, time as _time
+    import secrets
     user = frappe.session.user
-    conv = frappe.get_doc("Niv Conversation", conversation_id)
-    if conv.user != user and "System Manager" not in frappe.get_roles(user):
+    # Row lock serialises concurrent shares of the same conversation, so the
+    # probe below can't race another request into a second active share
+    owner = frappe.db.get_value("Niv Conversation", conversation_id, "user", for_update=True)
+    if owner is None:
+        frappe.throw("Conversation not found", frappe.DoesNotExistError)
+    if owner != user and "System Manager" not in frappe.get_roles(user):
         frappe.throw("Not your conversation", frappe.PermissionError)
 
-    # Check if already shared
+    # Check if already shared (backed by the conversation+shared_by index)
     existing = frappe.db.get_value("Niv Shared Chat",
         {"conversation": conversation_id, "shared_by": user, "is_active": 1},
         ["name", "share_hash"], as_dict=True)
     if existing:
         return {"share_hash": existing.share_hash, "url": f"/app/niv-chat-shared/{existing.share_hash}"}
 
-    share_hash = hashlib.sha256(f"{conversation_id}-{user}-{_time.time()}".encode()).hexdigest()[:16]
-    doc = frappe.get_doc({
-        "doctype": "Niv Shared Chat",
-        "conversation": conversation_id,
-        "share_hash": share_hash,
-        "shared_by": user,
-        "is_active": 1,
-    })
-    doc.insert(ignore_permissions=True)
-    frappe.db.commit()
+    # Random 16-char token; share_hash is unique, so retry on the rare collision
+    for attempt in range(3):
+        share_hash = secrets.token_urlsafe(12)
+        try:
+            frappe.get_doc({
+                "doctype": "Niv Shared Chat",
+                "conversation": conversation_id,
+                "share_hash": share_hash,
+                "shared_by": user,
+                "is_active": 1,
+            }).insert(ignore_permissions=True)
+            break
+        except (frappe.UniqueValidationError, frappe.DuplicateEntryError):
+            if attempt == 2:
+                raise
     return {"share_hash": share_hash, "url": f"/app/niv-chat-shared/{share_hash}"}
 
 
+# Shared chat views are cached briefly in Redis. Deactivating a share,
+# deleting it or changing the conversation's messages evicts the copy.
+SHARED_CHAT_CACHE_PREFIX = "niv_ai:shared_chat:"
+
+
+def _evict_shared_chat(share_hash):
+    """Drop a shared chat from the cache, now and again after commit —
+    a viewer reading before the commit could re-cache the old state."""
+    if not share_hash:
+        return
+    cache_key = f"{SHARED_CHAT_CACHE_PREFIX}{share_hash}"
+    frappe.cache().delete_value(cache_key)
+    after_commit = getattr(frappe.db, "after_commit", None)
+    if after_commit is not None:
+        after_commit.add(lambda: frappe.cache().delete_value(cache_key))
+
+
+def evict_conversation_shares(conversation):
+    """Evict every cached share of a conversation (backed by the
+    conversation+shared_by index)."""
+    if not conversation:
+        return
+    for share_hash in frappe.get_all("Niv Shared Chat",
+            filters={"conversation": conversation}, pluck="share_hash"):
+        _evict_shared_chat(share_hash)
+
+
 @frappe.whitelist(allow_guest=True)
 def get_shared_messages(share_hash):
     """Get messages for a shared chat (no login required)"""
-    shared = frappe.db.get_value("Niv Shared Chat",
-        {"share_hash": share_hash, "is_active": 1},
-        ["conversation", "expires_at"], as_dict=True)
+    cache_key = f"{SHARED_CHAT_CACHE_PREFIX}{share_hash}"
+    cached = frappe.cache().get_value(cache_key)
+    if cached:
+        return cached
+
+    shared = frappe.db.sql("""
+        SELECT sc.conversation, sc.expires_at, c.title
+        FROM `tabNiv Shared Chat` sc
+        JOIN `tabNiv Conversation` c ON c.name = sc.conversation
+        WHERE sc.share_hash = %s AND sc.is_active = 1
+        LIMIT 1
+    """, (share_hash,), as_dict=True)
     if not shared:
         frappe.throw("Shared chat not found or expired", frappe.DoesNotExistError)
+    shared = shared[0]
 
-    if shared.expires_at and frappe.utils.now_datetime() > frappe.utils.get_datetime(shared.expires_at):
-        frappe.throw("This shared chat has expired", frappe.ValidationError)
+    ttl = 30
+    if shared.expires_at:
+        remaining = (frappe.utils.get_datetime(shared.expires_at) - frappe.utils.now_datetime()).total_seconds()
+        if remaining <= 0:
+            frappe.throw("This shared chat has expired", frappe.ValidationError)
+        ttl = min(ttl, int(remaining) or 1)
 
-    conv = frappe.get_doc("Niv Conversation", shared.conversation)
     messages = frappe.get_all(
         "Niv Message",
         filters={"conversation": shared.conversation},
         fields=["name", "role", "content", "creation"],
         order_by="creation ASC",
     )
-    return {"title": conv.title, "messages": messages}
+    result = {"title": shared.title, "messages": messages}
+    frappe.cache().set_value(cache_key, result, expires_in_sec=ttl)
+    return result
 
 
 @frappe.whitelist(allow_guest=False)
@@ -343,17 +397,47 @@ def search_conversations(query, limit=20):
         return []
 
     user = frappe.session.user
-    q = f"%{query.strip()}%"
+    terms = _fulltext_terms(query)
 
-    results = frappe.db.sql("""
+    if terms and _has_message_fulltext():
+        # Uses the FULLTEXT index added in install._ensure_db_indexes
+        condition = "MATCH(m.content) AGAINST (%(query)s IN BOOLEAN MODE)"
+        q = " ".join(f"+{t}*" for t in terms)
+    else:
+        condition = "m.content LIKE %(query)s"
+        q = f"%{query.strip()}%"
+
+    results = frappe.db.sql(f"""
         SELECT DISTINCT c.name, c.title, c.modified,
                SUBSTRING(m.content, 1, 200) as snippet
         FROM `tabNiv Conversation` c
         JOIN `tabNiv Message` m ON m.conversation = c.name
         WHERE c.user = %(user)s
-          AND m.content LIKE %(query)s
+          AND {condition}
         ORDER BY c.modified DESC
         LIMIT %(limit)s
     """, {"user": user, "query": q, "limit": int(limit)}, as_dict=True)
 
     return results
+
+
+def _fulltext_terms(query):
+    """Split a search query into words usable in a BOOLEAN MODE match.
+
+    Returns an empty list when any word is shorter than InnoDB's default
+    minimum token size (3) — those can only be found with LIKE.
+    """
+    cleaned = "".join(" " if ch in '+-<>()~*"@' else ch for ch in query)
+    terms = cleaned.split()
+    if not terms or any(len(t) < 3 for t in terms):
+        return []
+    return terms
+
+
+def _has_message_fulltext():
+    def _check():
+        if frappe.db.db_type != "mariadb":
+            return 0
+        return int(bool(frappe.db.has_index("tabNiv Message", "ft_niv_message_content")))
+
+    return frappe.cache().get_value("niv_ai:message_fulltext", generator=_check)
@@ -2,10 +2,22 @@
 Health Check API — Returns status of LLM, MCP, RAG, and billing systems.
 Endpoint: /api/method/niv_ai.niv_core.api.health.check
 """
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
 import frappe
 from niv_ai.niv_core.utils import get_niv_settings
 from frappe import _
 
+# Budget for all subsystem probes together — monitors typically give up
+# after ~10 s, so answer (with stragglers marked timed out) before that
+_CHECK_TIMEOUT = 8
+
+# Monitors poll check() every few seconds — reuse a recent healthy result
+_CHECK_CACHE_KEY = "niv_ai:health_check"
+_CHECK_CACHE_TTL = 15
+
 
 @frappe.whitelist(allow_guest=False)
 def check():
@@ -13,26 +25,26 @@ def check():
     if not frappe.has_permission("Niv Settings", "read"):
         frappe.throw(_("Insufficient permissions"), frappe.PermissionError)
 
+    cached = frappe.cache().get_value(_CHECK_CACHE_KEY)
+    if cached:
+        return cached
+
     result = {
         "status": "ok",
         "subsystems": {},
         "version": _get_version(),
     }
 
-    # 1. LLM Provider
-    result["subsystems"]["llm"] = _check_llm()
-
-    # 2. MCP Tools
-    result["subsystems"]["mcp"] = _check_mcp()
-
-    # 3. RAG Knowledge Base
-    result["subsystems"]["rag"] = _check_rag()
-
-    # 4. Billing
-    result["subsystems"]["billing"] = _check_billing()
-
-    # 5. Database
-    result["subsystems"]["database"] = _check_database()
+    # Probes are independent — run them concurrently so the endpoint
+    # takes as long as the slowest one, not the sum of all of them.
+    settings = get_niv_settings()
+    result["subsystems"] = _run_checks({
+        "llm": partial(_check_llm, settings=settings),
+        "mcp": _check_mcp,
+        "rag": partial(_check_rag, settings=settings),
+        "billing": partial(_check_billing, settings=settings),
+        "database": _check_database,
+    })
 
     # Overall status
     statuses = [s["status"] for s in result["subsystems"].values()]
@@ -41,9 +53,67 @@ def check():
     if all(s == "error" for s in statuses):
         result["status"] = "down"
 
+    # Only healthy results are cached so a degraded system is re-probed each call
+    if result["status"] == "ok":
+        frappe.cache().set_value(_CHECK_CACHE_KEY, result, expires_in_sec=_CHECK_CACHE_TTL)
+
     return result
 
 
+def _run_checks(checks):
+    """Run subsystem probes in parallel, each with its own site connection.
+
+    frappe.local is per-thread, so every worker initialises the site and
+    connects before calling the probe, and tears down afterwards. All
+    probes share one deadline; any still running then is reported as
+    timed out. Each probe's own DB statements are capped at the same
+    budget so a straggler thread doesn't outlive it by much.
+    """
+    site = frappe.local.site
+    user = frappe.session.user
+    deadline = time.monotonic() + _CHECK_TIMEOUT
+
+    def _run(fn):
+        frappe.init(site=site)
+        try:
+            frappe.connect()
+            _limit_statement_time(max(1, deadline - time.monotonic()))
+            frappe.set_user(user)
+            return fn()
+        finally:
+            frappe.destroy()
+
+    results = {}
+    pool = ThreadPoolExecutor(max_workers=len(checks))
+    try:
+        futures = {name: pool.submit(_run, fn) for name, fn in checks.items()}
+        wait(futures.values(), timeout=max(0, deadline - time.monotonic()))
+        for name, future in futures.items():
+            if not future.done():
+                results[name] = {"status": "error", "message": "Check timed out"}
+                continue
+            try:
+                results[name] = future.result()
+            except Exception as e:
+                results[name] = {"status": "error", "message": str(e)}
+    finally:
+        # Don't block the response on a straggler; its own timeouts end it
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+
+def _limit_statement_time(seconds):
+    """Cap each query on the current connection at `seconds`."""
+    try:
+        if frappe.db.db_type == "postgres":
+            frappe.db.sql(f"SET statement_timeout = {int(seconds * 1000)}")
+        else:
+            frappe.db.sql(f"SET SESSION max_statement_time = {float(seconds)}")
+    except Exception:
+        pass
+
+
 def _get_version():
     try:
         from niv_ai import __version__
@@ -65,9 +135,9 @@ def _get_version():
         return "unknown"
 
 
-def _check_llm():
+def _check_llm(settings=None):
     try:
-        settings = get_niv_settings()
+        settings = settings or get_niv_settings()
         api_key = settings.get_password("api_key", raise_exception=False)
         model = getattr(settings, "default_model", "") or ""
         base_url = getattr(settings, "api_base_url", "") or ""
@@ -96,22 +166,28 @@ def _check_llm():
         return {"status": "error", "message": str(e)}
 
 
-def _check_mcp():
+def _check_mcp(timeout=_CHECK_TIMEOUT):
     try:
-        from niv_ai.niv_core.mcp_client import get_all_mcp_tools
-        tools = get_all_mcp_tools()
+        from niv_ai.niv_core.mcp_client import get_all_active_servers, discover_tools
+        # Cached tool lists return at once; live discovery is bounded so
+        # the probe thread can't hang on an unreachable server
+        names = set()
+        for server_name in get_all_active_servers():
+            for tool in discover_tools(server_name, timeout=timeout):
+                names.add(tool.get("name", ""))
+        names.discard("")
         return {
             "status": "ok",
-            "tool_count": len(tools),
+            "tool_count": len(names),
             "source": "same-server (FAC)",
         }
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
-def _check_rag():
+def _check_rag(settings=None):
     try:
-        settings = get_niv_settings()
+        settings = settings or get_niv_settings()
         enabled = getattr(settings, "enable_knowledge_base", 0)
         if not enabled:
             return {"status": "disabled", "message": "Knowledge base disabled in settings"}
@@ -130,9 +206,9 @@ def _check_rag():
         return {"status": "error", "message": str(e)}
 
 
-def _check_billing():
+def _check_billing(settings=None):
     try:
-        settings = get_niv_settings()
+        settings = settings or get_niv_settings()
         mode = getattr(settings, "billing_mode", "Shared Pool") or "Shared Pool"
 
         if mode == "Shared Pool":
@@ -196,9 +272,11 @@ def deep_check():
     }
 
     # Run basic checks too
-    result["basic"]["llm"] = _check_llm()
-    result["basic"]["mcp"] = _check_mcp()
-    result["basic"]["database"] = _check_database()
+    result["basic"] = _run_checks({
+        "llm": partial(_check_llm, settings=get_niv_settings()),
+        "mcp": _check_mcp,
+        "database": _check_database,
+    })
 
     # Generate fix suggestions based on all findings
     result["fixes"] = _suggest_fixes(result)
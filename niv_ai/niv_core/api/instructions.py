@@ -1,6 +1,8 @@
 import frappe
 import json
 
+INSTRUCTIONS_CACHE_PREFIX = "niv_ai:instructions:"
+
 
 @frappe.whitelist()
 def get_instructions(user=None):
@@ -34,7 +36,7 @@ def get_instructions(user=None):
     return instructions
 
 
-@frappe.whitelist()
+@frappe.whitelist(methods=["POST"])
 def save_instruction(instruction, scope="Per User", priority=0):
     """Save a new custom instruction"""
     user = frappe.session.user
@@ -51,12 +53,11 @@ def save_instruction(instruction, scope="Per User", priority=0):
         "is_active": 1,
     })
     doc.insert(ignore_permissions=True)
-    frappe.db.commit()
 
     return {"success": True, "name": doc.name}
 
 
-@frappe.whitelist()
+@frappe.whitelist(methods=["POST"])
 def delete_instruction(name):
     """Delete a custom instruction"""
     user = frappe.session.user
@@ -67,14 +68,34 @@ def delete_instruction(name):
         frappe.throw("You can only delete your own instructions.")
 
     frappe.delete_doc("Niv Custom Instruction", name, ignore_permissions=True)
-    frappe.db.commit()
 
     return {"success": True}
 
 
 def get_instructions_for_prompt(user):
-    """Get formatted instructions string for system prompt injection"""
-    instructions = get_instructions(user)
+    """Get formatted instructions string for system prompt injection.
+
+    Cached per user — cleared on Niv Custom Instruction save/delete.
+    """
+    cache_key = f"{INSTRUCTIONS_CACHE_PREFIX}{user}"
+    cached = frappe.cache().get_value(cache_key)
+    if cached is not None:
+        return cached
+
+    formatted = _format_instructions(get_instructions(user))
+    frappe.cache().set_value(cache_key, formatted, expires_in_sec=3600)
+    return formatted
+
+
+def clear_instructions_cache(user=None):
+    """Clear cached prompt instructions for one user, or for everyone."""
+    if user:
+        frappe.cache().delete_value(f"{INSTRUCTIONS_CACHE_PREFIX}{user}")
+    else:
+        frappe.cache().delete_keys(INSTRUCTIONS_CACHE_PREFIX)
+
+
+def _format_instructions(instructions):
     if not instructions:
         return ""
 
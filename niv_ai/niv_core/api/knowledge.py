@@ -14,7 +14,7 @@ def search_knowledge(query, limit=5):
         return []
 
     # Split query into keywords
-    keywords = [k.strip().lower() for k in query.split() if len(k.strip()) >= 2]
+    keywords = [k.lower() for k in query.split() if len(k) >= 2]
     if not keywords:
         return []
 
@@ -91,7 +91,7 @@ def index_document(kb_name):
     frappe.db.commit()
 
 
-@frappe.whitelist(allow_guest=False)
+@frappe.whitelist(allow_guest=False, methods=["POST"])
 def add_document(title, content, category=None):
     """Create a Knowledge Base entry and auto-index it."""
     doc = frappe.get_doc({
@@ -102,7 +102,6 @@ def add_document(title, content, category=None):
         "is_active": 1,
     })
     doc.insert(ignore_permissions=True)
-    frappe.db.commit()
     return {"name": doc.name, "message": f"Knowledge base '{title}' created and indexed."}
 
 
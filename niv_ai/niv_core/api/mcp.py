@@ -61,6 +61,8 @@ def toggle_server(server_name, is_active):
         if doc_name:
             is_active_val = 1 if (is_active and str(is_active) not in ("0", "false", "False")) else 0
             frappe.db.set_value("Niv MCP Server", doc_name, "is_active", is_active_val)
+            # Commit before clearing caches, otherwise another worker can
+            # refill them from the not-yet-committed (old) server list
             frappe.db.commit()
             # Clear ALL MCP caches (worker + redis + langchain tools)
             try:
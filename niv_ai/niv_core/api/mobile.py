@@ -8,6 +8,7 @@ import string
 import frappe
 from niv_ai.niv_core.utils import get_niv_settings
 from frappe import _
+from frappe.utils.password import set_encrypted_password
 from datetime import datetime, timedelta
 
 
@@ -61,14 +62,13 @@ def my_pairing_code():
     if user_email == "Guest":
         frappe.throw(_("Please login first"))
 
-    # Deactivate old active codes for this user
-    old_codes = frappe.get_all(
+    # Deactivate old active codes for this user (single UPDATE)
+    frappe.db.set_value(
         "Niv Pairing Code",
-        filters={"frappe_user": user_email, "status": "Active"},
-        pluck="name",
+        {"frappe_user": user_email, "status": "Active"},
+        "status",
+        "Expired",
     )
-    for name in old_codes:
-        frappe.db.set_value("Niv Pairing Code", name, "status", "Expired")
 
     # Generate new code
     code = _generate_unique_code()
@@ -135,21 +135,20 @@ def pair(code=None, device_name=None):
     # Generate API key + secret for this user
     api_key, api_secret = _generate_api_credentials(user_email)
 
-    # Mark code as used
+    # Mark code as used — the column keeps the usual Password mask and the
+    # secret itself goes straight to __Auth, without loading the doc
     frappe.db.set_value("Niv Pairing Code", pairing.name, {
         "status": "Used",
         "paired_at": datetime.now(),
         "device_name": device_name,
         "api_key": api_key,
+        "api_secret": "*" * len(api_secret),
     })
-    # Store secret separately (Password field)
-    doc = frappe.get_doc("Niv Pairing Code", pairing.name)
-    doc.api_secret = api_secret
-    doc.save(ignore_permissions=True)
-    frappe.db.commit()
+    set_encrypted_password("Niv Pairing Code", pairing.name, api_secret, "api_secret")
+    # Credentials + pairing update are one transaction, committed at request end
 
-    # Get user info
-    user_doc = frappe.get_doc("User", user_email)
+    # Get user info (scalar fields only — no need to load the User doc)
+    user_info = frappe.db.get_value("User", user_email, ["full_name", "user_image"], as_dict=True) or {}
 
     # Get AI config
     settings = get_niv_settings()
@@ -162,10 +161,9 @@ def pair(code=None, device_name=None):
             fields=["name", "company_name", "company_logo", "abbr"],
             order_by="creation asc",
         )
+        base_url = frappe.utils.get_url()
         for c in company_list:
-            logo_url = ""
-            if c.company_logo:
-                logo_url = frappe.utils.get_url() + c.company_logo
+            logo_url = f"{base_url}{c.company_logo}" if c.company_logo else ""
             companies.append({
                 "name": c.name,
                 "company_name": c.company_name,
@@ -185,8 +183,8 @@ def pair(code=None, device_name=None):
         },
         "user": {
             "email": user_email,
-            "full_name": user_doc.full_name,
-            "user_image": user_doc.user_image,
+            "full_name": user_info.get("full_name"),
+            "user_image": user_info.get("user_image"),
         },
         "companies": companies,
         "config": {
@@ -210,19 +208,20 @@ def verify_token():
         api_key, api_secret = token.split(":")
 
         # Validate API key on User doctype
-        user_email = frappe.db.get_value("User", {"api_key": api_key}, "name")
-        if not user_email:
+        user_info = _resolve_token(api_key)
+        if not user_info:
             return {"valid": False, "reason": "Invalid API key"}
 
-        user_doc = frappe.get_doc("User", user_email)
-        if not user_doc.enabled:
+        if not user_info["enabled"]:
             return {"valid": False, "reason": "User disabled"}
+        user_email = user_info["email"]
 
         # Get companies
         companies = []
         try:
+            base_url = frappe.utils.get_url()
             for c in frappe.get_all("Company", fields=["name", "company_name", "company_logo", "abbr"]):
-                logo_url = (frappe.utils.get_url() + c.company_logo) if c.company_logo else ""
+                logo_url = f"{base_url}{c.company_logo}" if c.company_logo else ""
                 companies.append({"name": c.name, "company_name": c.company_name, "logo": logo_url, "abbr": c.abbr or ""})
         except Exception:
             pass
@@ -231,8 +230,8 @@ def verify_token():
             "valid": True,
             "user": {
                 "email": user_email,
-                "full_name": user_doc.full_name,
-                "user_image": user_doc.user_image,
+                "full_name": user_info["full_name"],
+                "user_image": user_info["user_image"],
             },
             "companies": companies,
         }
@@ -256,26 +255,85 @@ def revoke_pairing(pairing_code_name):
         )
         if api_keys:
             frappe.delete_doc("User API Key", api_keys[0].name, ignore_permissions=True)
+        _evict_token(doc.api_key)
 
     doc.status = "Expired"
     doc.save(ignore_permissions=True)
-    frappe.db.commit()
 
     return {"ok": True, "message": "Pairing revoked and API key deleted"}
 
 
 # ── Helper Functions ──
 
+# verify_token runs on every app start / reconnect — keep the API key → user
+# lookup in Redis for a short time. Shared by all workers, so _evict_token
+# takes effect everywhere at once.
+TOKEN_CACHE_PREFIX = "niv_ai:mobile_token:"
+TOKEN_CACHE_TTL = 30
+
+
+def _resolve_token(api_key):
+    """Return {email, enabled, full_name, user_image} for an API key, or None."""
+    cache_key = f"{TOKEN_CACHE_PREFIX}{api_key}"
+    cached = frappe.cache().get_value(cache_key)
+    if cached is not None:
+        return cached
+
+    user = frappe.db.get_value(
+        "User", {"api_key": api_key},
+        ["name", "enabled", "full_name", "user_image"], as_dict=True,
+    )
+    if not user:
+        return None
+
+    user_info = {
+        "email": user.name,
+        "enabled": user.enabled,
+        "full_name": user.full_name,
+        "user_image": user.user_image,
+    }
+    frappe.cache().set_value(cache_key, user_info, expires_in_sec=TOKEN_CACHE_TTL)
+    return user_info
+
+
+def _evict_token(api_key):
+    """Drop an API key from the token cache, now and again after commit —
+    a verify_token running before the commit could re-cache the old state."""
+    if not api_key:
+        return
+    cache_key = f"{TOKEN_CACHE_PREFIX}{api_key}"
+    frappe.cache().delete_value(cache_key)
+    after_commit = getattr(frappe.db, "after_commit", None)
+    if after_commit is not None:
+        after_commit.add(lambda: frappe.cache().delete_value(cache_key))
+
+
+def evict_user_token(doc, method=None):
+    """User on_update/on_trash hook — disabling a user or changing their API
+    key must not leave the old lookup cached."""
+    _evict_token(doc.get("api_key"))
+    before = doc.get_doc_before_save() if method == "on_update" else None
+    if before and before.get("api_key") != doc.get("api_key"):
+        _evict_token(before.get("api_key"))
+
+# Pairing code alphabet, without confusing chars: O, 0, I, 1, L
+_PAIR_CHARS = tuple(c for c in string.ascii_uppercase + string.digits if c not in "O0I1L")
+
+
 def _generate_unique_code():
     """Generate a unique 8-character alphanumeric pairing code."""
-    chars = string.ascii_uppercase + string.digits
-    # Remove confusing chars: O, 0, I, 1, L
-    chars = chars.replace("O", "").replace("0", "").replace("I", "").replace("1", "").replace("L", "")
-
-    for _ in range(100):  # max attempts
-        code = "".join(secrets.choice(chars) for _ in range(8))
-        if not frappe.db.exists("Niv Pairing Code", {"code": code}):
-            return code
+
+    # Check a batch of candidates with one query instead of one per attempt
+    for _ in range(5):  # max attempts
+        candidates = ["".join(secrets.choice(_PAIR_CHARS) for _ in range(8)) for _ in range(16)]
+        taken = set(frappe.get_all(
+            "Niv Pairing Code",
+            filters={"code": ["in", candidates]},
+            pluck="code",
+        ))
+        for code in candidates:
+            if code not in taken:
+                return code
 
     frappe.throw(_("Could not generate unique code. Try again."))
 
@@ -40,14 +40,13 @@ def get_my_pairing_code():
     site_url = getattr(settings, "mobile_site_url", "") or frappe.utils.get_url()
     expires_at = datetime.now() + timedelta(hours=int(expiry_hours))
 
-    # Expire old codes for this user
-    old_codes = frappe.get_all(
+    # Expire old codes for this user (single UPDATE)
+    frappe.db.set_value(
         "Niv Pairing Code",
-        filters={"frappe_user": user, "status": "Active"},
-        pluck="name"
+        {"frappe_user": user, "status": "Active"},
+        "status",
+        "Expired",
     )
-    for old in old_codes:
-        frappe.db.set_value("Niv Pairing Code", old, "status", "Expired")
 
     # Create new pairing code
     doc = frappe.get_doc({
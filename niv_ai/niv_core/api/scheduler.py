@@ -12,34 +12,46 @@ def run_scheduled_reports():
     current_time = now.time()
     day_name = now.strftime("%A")  # e.g., "Monday"
 
+    schedules = ["Daily", "Weekly"]
+    if today.day == 1:
+        schedules.append("Monthly")
+
+    # Skip reports already run today in SQL instead of parsing last_run per row
     reports = frappe.get_all(
         "Niv Scheduled Report",
-        filters={"is_active": 1},
+        filters={"is_active": 1, "schedule": ["in", schedules]},
+        or_filters=[
+            ["last_run", "is", "not set"],
+            ["last_run", "<", frappe.utils.get_datetime(today)],
+        ],
         fields=["name", "user", "report_prompt", "schedule", "day_of_week",
                 "time", "last_run", "conversation"],
     )
 
+    # Group by user so the session is switched once per user, not per report
+    reports_by_user = {}
     for report in reports:
-        if not _is_due(report, today, day_name, current_time):
-            continue
+        if _is_due(report, today, day_name, current_time):
+            reports_by_user.setdefault(report.user, []).append(report)
 
+    for user, user_reports in reports_by_user.items():
+        # Execute as the report's user
+        frappe.set_user(user)
         try:
-            _execute_report(report)
-        except Exception as e:
-            frappe.log_error(
-                f"Scheduled report {report.name} failed: {e}",
-                "Niv Scheduled Report Error"
-            )
+            for report in user_reports:
+                try:
+                    _execute_report(report)
+                except Exception as e:
+                    frappe.log_error(
+                        f"Scheduled report {report.name} failed: {e}",
+                        "Niv Scheduled Report Error"
+                    )
+        finally:
+            frappe.set_user("Administrator")
 
 
 def _is_due(report, today, day_name, current_time):
-    """Check if a report is due to run."""
-    # If already run today, skip
-    if report.last_run:
-        last_run_date = frappe.utils.get_datetime(report.last_run).date()
-        if last_run_date == today:
-            return False
-
+    """Check if a report is due to run (reports already run today are filtered out in SQL)."""
     schedule = report.schedule
 
     if schedule == "Daily":
@@ -73,15 +85,11 @@ def _execute_report(report):
         conversation_id = conv.name
         frappe.db.set_value("Niv Scheduled Report", report.name, "conversation", conversation_id)
 
-    # Execute as the report's user
-    frappe.set_user(user)
-    try:
-        result = send_message(
-            conversation_id=conversation_id,
-            message=report.report_prompt,
-        )
-    finally:
-        frappe.set_user("Administrator")
+    # Caller has already switched the session to the report's user
+    result = send_message(
+        conversation_id=conversation_id,
+        message=report.report_prompt,
+    )
 
     # Update last_run
     frappe.db.set_value("Niv Scheduled Report", report.name, "last_run", frappe.utils.now_datetime())
@@ -4,9 +4,19 @@ Handles request parsing, message saving, and SSE response streaming.
 The agent (agent.py) handles all LLM/tool logic.
 """
 import json
+import re
+import time
 import frappe
 from frappe import _
-from niv_ai.niv_core.api._helpers import validate_conversation, save_user_message, save_assistant_message, auto_title
+from werkzeug.wrappers import Response
+from niv_ai.niv_core.utils import get_niv_settings, fast_json
+from niv_ai.niv_core.api._helpers import validate_conversation, claim_user_message, save_turn
+from niv_ai.niv_core.langchain.agent import stream_agent
+
+try:
+    from niv_ai.niv_core.utils.rate_limiter import check_rate_limit, RateLimitExceeded
+except ImportError:
+    check_rate_limit = None
 
 
 # ─── Simple Query Detection ────────────────────────────────────────
@@ -20,6 +30,8 @@ _SIMPLE_PATTERNS = frozenset({
     "gm", "gn", "morning", "evening",
     "hmm", "hm", "oh", "ah", "wow",
 })
+# Longest message (plus trailing punctuation slack) that can match exactly
+_SIMPLE_MAX_LEN = max(len(p) for p in _SIMPLE_PATTERNS) + 3
 
 _QUESTION_WORDS = frozenset({
     "what", "how", "why", "when", "where", "which", "who",
@@ -28,27 +40,44 @@ _QUESTION_WORDS = frozenset({
     "calculate", "report", "export", "analyze",
 })
 
+# One precompiled alternation scans for all question/action words instead
+# of one substring test per word
+_QUESTION_RE = re.compile("|".join(re.escape(w) for w in sorted(_QUESTION_WORDS, key=len, reverse=True)))
+
+
+def _has_question_word(msg: str) -> bool:
+    """True if any question/action word occurs anywhere in msg."""
+    return _QUESTION_RE.search(msg) is not None
 
-def _check_rate_limit(user=None):
-    """Rate limit check - uses settings if configured."""
+
+def _check_rate_limit(user=None, settings=None):
+    """Rate limit check - uses settings if configured. Responds 429 when exceeded."""
+    if check_rate_limit is None:
+        return
     try:
-        from niv_ai.niv_core.utils.rate_limiter import check_rate_limit
-        check_rate_limit(user)
-    except ImportError:
-        pass
+        check_rate_limit(user, settings=settings)
+    except RateLimitExceeded as e:
+        frappe.throw(e.message, frappe.TooManyRequestsError, title=_("Rate Limited"))
 
 
 def _is_simple_query(message: str) -> bool:
-    """Detect simple queries that don't need a powerful model."""
-    msg = (message or "").strip().lower()
-    word_count = len(msg.split())
+    """Detect simple queries that don't need a powerful model.
+
+    stream_chat passes the message already stripped.
+    """
+    msg = message or ""
+    # Exact match against simple patterns first (strip trailing punctuation) —
+    # the common "hi"/"ok"/"thanks" case needs nothing else
+    if len(msg) <= _SIMPLE_MAX_LEN and msg.lower().rstrip("!.?") in _SIMPLE_PATTERNS:
+        return True
+    # maxsplit stops after the 4th word — long messages bail out without
+    # splitting, lowercasing or scanning the whole text
+    word_count = len(msg.split(maxsplit=3))
     if word_count > 3:
         return False
-    # Check exact match against simple patterns (strip trailing punctuation)
-    if msg.rstrip("!.?") in _SIMPLE_PATTERNS:
-        return True
+    msg = msg.lower()
     # 1-2 word messages without question/action words
-    if word_count <= 2 and not any(w in msg for w in _QUESTION_WORDS):
+    if word_count <= 2 and not _has_question_word(msg):
         return True
     return False
 
@@ -75,11 +104,90 @@ def _ensure_db(site_name=None):
                 pass
 
 
+def _is_connection_error(e):
+    """True for lost-connection errors ("server has gone away", InterfaceError(0, ''))."""
+    try:
+        import pymysql
+    except ImportError:
+        return False
+    return isinstance(e, (pymysql.err.InterfaceError, pymysql.err.OperationalError))
+
+
+def _release_db():
+    """Close the stream's own DB connection once it has no more DB work.
+
+    generate() runs after the request has been torn down and opens its own
+    connection; without this it stays open for as long as the client keeps
+    reading the stream.
+    """
+    try:
+        if frappe.db:
+            frappe.db.close()
+    except Exception:
+        pass
+
+
 # ─── SSE Formatting ────────────────────────────────────────────────
 
+# Token events dominate the stream — their frame is a fixed prefix/suffix
+# around the JSON-escaped content, so skip building and dumping a dict.
+_TOKEN_PREFIX = b'data: {"type":"token","content":'
+_TOKEN_SUFFIX = b'}\n\n'
+
+
 def _sse(data):
-    """Format SSE event."""
-    return f"data: {json.dumps(data)}\n\n"
+    """Format SSE event.
+
+    Agent events are plain JSON types (tool results are already str), so
+    serialize without a default hook; only an odd payload pays for the
+    str() fallback.
+    """
+    try:
+        payload = fast_json.dumps(data, default=None)
+    except TypeError:
+        payload = fast_json.dumps(data)
+    return b"data: " + payload + b"\n\n"
+
+
+def _sse_token(content):
+    """Format a token SSE event (same bytes as _sse for a token dict)."""
+    return b"".join((_TOKEN_PREFIX, fast_json.dumps(content, default=None), _TOKEN_SUFFIX))
+
+
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+    "Connection": "keep-alive",
+    # A set Content-Encoding keeps proxy gzip from buffering the stream
+    "Content-Encoding": "identity",
+}
+
+
+def _sse_response(gen):
+    """Wrap an SSE byte generator in a streaming response.
+
+    Every frame is already bytes, so direct_passthrough hands the generator
+    to the WSGI server as-is instead of re-checking/encoding each item.
+    """
+    return Response(gen, content_type="text/event-stream", headers=_SSE_HEADERS,
+                    direct_passthrough=True)
+
+
+def _emit_simple(text, conversation_id, user_message, user_message_at, user, site_name):
+    """Stream a fixed reply (no agent run) and save it as the turn."""
+    def gen():
+        yield _sse_token(text)
+        _ensure_db(site_name)
+        save_turn(conversation_id, user_message, user_message_at, user, text)
+        _release_db()
+        yield _sse({"type": "done", "content": "", "input_tokens": 0, "output_tokens": 0, "total_tokens": 0})
+    return _sse_response(gen())
+
+
+# Tokens are coalesced into one frame until this many chars are buffered or
+# this long has passed since the last frame — fewer frames/writes per reply
+_TOKEN_FLUSH_CHARS = 64
+_TOKEN_FLUSH_SECS = 0.02
 
 
 # ─── Main Endpoint ─────────────────────────────────────────────────
@@ -89,27 +197,23 @@ def stream_chat(**kwargs):
     """Stream chat via Niv AI Agent (SSE)."""
     
     # ── Parse request ──
+    # Body is parsed once; GET params arrive as kwargs. form_dict is the fallback.
     if frappe.request.method == "POST":
         try:
             data = frappe.request.get_json(silent=True) or {}
         except Exception:
             data = {}
-        conversation_id = data.get("conversation_id") or frappe.form_dict.get("conversation_id")
-        message = data.get("message") or frappe.form_dict.get("message")
-        page_context = data.get("context") or frappe.form_dict.get("context")
-        model = data.get("model") or frappe.form_dict.get("model")
     else:
-        conversation_id = kwargs.get("conversation_id") or frappe.form_dict.get("conversation_id")
-        message = kwargs.get("message") or frappe.form_dict.get("message")
-        page_context = kwargs.get("context") or frappe.form_dict.get("context")
-        model = kwargs.get("model") or frappe.form_dict.get("model")
+        data = kwargs
+    form = frappe.form_dict
+
+    conversation_id = data.get("conversation_id") or form.get("conversation_id")
+    message = data.get("message") or form.get("message")
+    page_context = data.get("context") or form.get("context")
+    model = data.get("model") or form.get("model")
 
     # Parse voice_mode (skip two-model for faster response)
-    if frappe.request.method == "POST":
-        voice_mode = data.get("voice_mode") or frappe.form_dict.get("voice_mode")
-    else:
-        voice_mode = kwargs.get("voice_mode") or frappe.form_dict.get("voice_mode")
-    voice_mode = int(voice_mode or 0)
+    voice_mode = int(data.get("voice_mode") or form.get("voice_mode") or 0)
 
     # Parse page context JSON
     if page_context and isinstance(page_context, str):
@@ -119,11 +223,8 @@ def stream_chat(**kwargs):
             page_context = None
 
     # Parse attachments
-    if frappe.request.method == "POST":
-        attachments_raw = data.get("attachments") or frappe.form_dict.get("attachments")
-    else:
-        attachments_raw = kwargs.get("attachments") or frappe.form_dict.get("attachments")
-    
+    attachments_raw = data.get("attachments") or form.get("attachments")
+
     attachments = []
     if attachments_raw:
         if isinstance(attachments_raw, str):
@@ -141,16 +242,21 @@ def stream_chat(**kwargs):
     if not message:
         frappe.throw(_("Message cannot be empty"))
 
+    # Loaded once and reused for routing, billing and the saved model name
+    try:
+        settings = get_niv_settings()
+    except Exception:
+        settings = None
+
+    # Rate limit first — it only touches Redis, so an over-limit request is
+    # rejected before any conversation/message DB work
+    _check_rate_limit(user, settings)
+
     # ── Auto-route simple queries to fast model ──
-    if not model:
-        try:
-            from niv_ai.niv_core.utils import get_niv_settings
-            _settings = get_niv_settings()
-            fast_model = getattr(_settings, "fast_model", None)
-            if fast_model and _is_simple_query(message):
-                model = fast_model
-        except Exception:
-            pass
+    if not model and settings:
+        fast_model = getattr(settings, "fast_model", None)
+        if fast_model and _is_simple_query(message):
+            model = fast_model
 
     # ── Auto-create conversation if needed ──
     if not conversation_id:
@@ -161,22 +267,30 @@ def stream_chat(**kwargs):
             "channel": "web",
         })
         conv.insert(ignore_permissions=True)
-        frappe.db.commit()
+        # POST is committed by Frappe when the handler returns, before the
+        # stream starts. GET (EventSource) is not, and the generator writes
+        # to this conversation over its own connection.
+        if frappe.request.method != "POST":
+            frappe.db.commit()
         conversation_id = conv.name
 
     validate_conversation(conversation_id, user)
-    save_user_message(conversation_id, message, dedup=True)
+    # The user message is written together with the reply once the stream
+    # ends; a retry of the same message within 30s doesn't add a second row
+    _user_message = message if claim_user_message(conversation_id, message) else None
+    _user_message_at = frappe.utils.now_datetime()
 
     # -- Check token balance BEFORE running agent --
+    # The same balance also seeds the mid-stream check below
     _insufficient_balance = False
     _balance_msg = ""
-    try:
-        from niv_ai.niv_core.utils import get_niv_settings
-        _billing_settings = get_niv_settings()
-        if getattr(_billing_settings, 'enable_billing', False):
+    _user_token_balance = 0
+    if getattr(settings, 'enable_billing', False):
+        try:
             from niv_ai.niv_billing.api.billing import check_balance
             _bal = check_balance(user)
             _user_balance = _bal.get('balance', 0)
+            _user_token_balance = _user_balance
             _msg_tokens = max(1, len(message) // 4)
             _estimated_min = 3000 + _msg_tokens + 500  # system prompt ~2500 + history ~500 + response ~500
             if _user_balance < _estimated_min:
@@ -186,56 +300,59 @@ def stream_chat(**kwargs):
                     f'Estimated minimum required: ~{_estimated_min:,} tokens. '
                     f'Please recharge your tokens to continue using the AI assistant.'
                 )
-    except Exception as _bex:
-        import traceback
-        frappe.log_error(f"Balance pre-check FAILED: {_bex}\n{traceback.format_exc()}", "Niv Balance PreCheck")
-
-    # Track balance for mid-stream check
-    _user_token_balance = 0
-    try:
-        if not _insufficient_balance:
-            from niv_ai.niv_core.utils import get_niv_settings
-            _bs = get_niv_settings()
-            if getattr(_bs, 'enable_billing', False):
-                from niv_ai.niv_billing.api.billing import check_balance as _cb
-                _user_token_balance = _cb(user).get('balance', 0)
-    except Exception:
-        _user_token_balance = 999999  # if check fails, don't block
+        except Exception as _bex:
+            import traceback
+            frappe.log_error(f"Balance pre-check FAILED: {_bex}\n{traceback.format_exc()}", "Niv Balance PreCheck")
+            _user_token_balance = 999999  # if check fails, don't block
 
     _site_name = frappe.local.site
 
+    # If balance is insufficient, send message and stop immediately
+    if _insufficient_balance:
+        return _emit_simple(_balance_msg, conversation_id, _user_message, _user_message_at, user, _site_name)
+
     def generate():
-        import time as _time
-        
         full_response = ""
         tool_calls_data = []
         _balance_exhausted = False
         _next_balance_check = 2000  # check every 2000 chars
 
-        # If balance is insufficient, send message and stop immediately
-        if _insufficient_balance:
-            yield _sse({"type": "token", "content": _balance_msg})
-            full_response = _balance_msg
-            _ensure_db(_site_name)
-            save_assistant_message(conversation_id, _balance_msg, [])
-            yield _sse({"type": "done", "content": "", "input_tokens": 0, "output_tokens": 0, "total_tokens": 0})
-            return
         token_data = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
-        _last_db_check = _time.time()
-
-        def _heartbeat_db():
-            """Keep DB alive during long streams."""
+        _last_db_check = time.time()
+        _token_buf = []
+        _token_buf_len = 0
+        _client_gone = False
+        _last_flush = time.monotonic()
+
+        def _flush_tokens():
+            """Return one token frame for everything buffered (None if empty)."""
+            nonlocal _token_buf_len, _last_flush
+            _last_flush = time.monotonic()
+            if not _token_buf:
+                return None
+            frame = _sse_token("".join(_token_buf))
+            _token_buf.clear()
+            _token_buf_len = 0
+            return frame
+
+        def _db_check_due(max_age=5):
+            return time.time() - _last_db_check > max_age
+
+        def _heartbeat_db(max_age=5):
+            """Keep DB alive during long streams — probes at most once per max_age seconds."""
             nonlocal _last_db_check
-            now = _time.time()
-            if now - _last_db_check > 5:
+            if _db_check_due(max_age):
                 _ensure_db(_site_name)
-                _last_db_check = now
+                _last_db_check = time.time()
 
         try:
-            frappe.init(site=_site_name)
-            frappe.connect()
-
-            from niv_ai.niv_core.langchain.agent import stream_agent
+            # Re-init only if Frappe already tore down the request context;
+            # a leftover frappe.db object may still have a closed connection,
+            # so check the connection itself before streaming
+            if getattr(frappe.local, "site", None) != _site_name:
+                frappe.init(site=_site_name)
+            _ensure_db(_site_name)
+            _last_db_check = time.time()
 
             for event in stream_agent(
                 message=message,
@@ -244,32 +361,41 @@ def stream_chat(**kwargs):
                 model=model or None,
                 page_context=page_context,
                 attachments=attachments,
-                voice_mode=bool(voice_mode if 'voice_mode' in dir() else 0),
+                voice_mode=bool(voice_mode),
             ):
-                _heartbeat_db()
                 event_type = event.get("type", "")
 
+                # Buffered text goes out first: before any other event
+                # (tool_call, tool_result, thought, error, ...) and before a
+                # DB heartbeat, which may block on a reconnect
+                if _token_buf and (event_type != "token" or _db_check_due()):
+                    yield _flush_tokens()
+                _heartbeat_db()
+
                 if event_type == "token":
                     content = event.get("content", "")
                     if content:
                         full_response += content
-                        yield _sse(event)
-                        
+                        _token_buf.append(content)
+                        _token_buf_len += len(content)
+                        if (_token_buf_len >= _TOKEN_FLUSH_CHARS
+                                or time.monotonic() - _last_flush >= _TOKEN_FLUSH_SECS):
+                            yield _flush_tokens()
+
                         # Mid-stream balance check (every ~2000 chars)
-                        if len(full_response) > _next_balance_check:
-                            frappe.log_error(f"Mid-stream check: balance={_user_token_balance}, response_len={len(full_response)}, estimate={3000 + max(1, len(full_response) // 4)}", "Niv Balance Debug")
                         if _user_token_balance > 0 and len(full_response) > _next_balance_check:
                             _next_balance_check += 2000
                             _consumed_estimate = 3000 + max(1, len(full_response) // 4)
                             if _consumed_estimate >= _user_token_balance:
                                 _cutoff_msg = "\n\n---\n⚠️ Your token balance has been exhausted. Please recharge to continue."
                                 full_response += _cutoff_msg
-                                yield _sse({"type": "token", "content": _cutoff_msg})
+                                _token_buf.append(_cutoff_msg)
+                                yield _flush_tokens()
                                 _balance_exhausted = True
                                 break
 
                 elif event_type == "tool_call":
-                    _ensure_db(_site_name)  # DB must be alive before tool execution
+                    _heartbeat_db(max_age=1)  # DB must be alive before tool execution
                     tool_calls_data.append({
                         "tool": event.get("tool", ""),
                         "arguments": event.get("arguments", {})
@@ -277,7 +403,7 @@ def stream_chat(**kwargs):
                     yield _sse(event)
 
                 elif event_type == "tool_result":
-                    _ensure_db(_site_name)
+                    _heartbeat_db(max_age=1)
                     yield _sse(event)
 
                 elif event_type == "thought":
@@ -299,14 +425,22 @@ def stream_chat(**kwargs):
                 else:
                     yield _sse(event)
 
+        except GeneratorExit:
+            # Client went away (e.g. Stop) — still save what was streamed,
+            # but yielding again would be an error
+            _client_gone = True
+            raise
+
         except Exception as e:
+            if _token_buf:
+                yield _flush_tokens()
             error_str = str(e).lower()
             # Check if this is a billing/token error
             if any(kw in error_str for kw in ['insufficient', 'credit', 'balance', 'daily limit', 'exhausted', 'recharge']):
                 billing_msg = f"Your token balance is not enough to process this query. Please recharge your tokens to continue using the AI assistant."
                 if not full_response.strip():
                     full_response = billing_msg
-                yield _sse({"type": "token", "content": billing_msg})
+                yield _sse_token(billing_msg)
             else:
                 error_msg = f"Error: {str(e)}"
                 if not full_response.strip():
@@ -315,54 +449,49 @@ def stream_chat(**kwargs):
                 yield _sse({"type": "error", "content": error_msg})
 
         finally:
-            # ── Fallback: if tools ran but no text response, tell the user ──
-            if not full_response.strip() and tool_calls_data:
-                full_response = "I found some data but couldn't generate a response. Please try rephrasing your question."
-                yield _sse({"type": "token", "content": full_response})
-            
-            # ── Fallback: completely empty response ──
+            # ── Fallbacks for an empty response (one strip of the full text) ──
             if not full_response.strip():
-                full_response = "I couldn't generate a response. Please try again."
-                yield _sse({"type": "token", "content": full_response})
+                if tool_calls_data:
+                    # Tools ran but no text response, tell the user
+                    full_response = "I found some data but couldn't generate a response. Please try rephrasing your question."
+                else:
+                    full_response = "I couldn't generate a response. Please try again."
+                _token_buf.append(full_response)
 
-            # ── Save assistant message to DB ──
-            _ensure_db(_site_name)
-            _model_used = model
-            if not _model_used:
+            # ── Send remaining text + done first; the save below is not
+            # something the client has to wait for ──
+            if not _client_gone:
                 try:
-                    from niv_ai.niv_core.utils import get_niv_settings
-                    _s = get_niv_settings()
-                    _model_used = _s.default_model
-                except Exception:
+                    if _token_buf:
+                        yield _flush_tokens()
+                    yield _sse({
+                        "type": "done", "content": "",
+                        "input_tokens": token_data.get("input_tokens", 0),
+                        "output_tokens": token_data.get("output_tokens", 0),
+                        "total_tokens": token_data.get("total_tokens", 0),
+                    })
+                except GeneratorExit:
                     pass
-            
-            try:
-                save_assistant_message(
-                    conversation_id, full_response, tool_calls_data,
-                    input_tokens=token_data.get("input_tokens", 0),
-                    output_tokens=token_data.get("output_tokens", 0),
-                    total_tokens=token_data.get("total_tokens", 0),
-                    model=_model_used,
-                )
-                auto_title(conversation_id, message)
-            except Exception as e:
-                frappe.log_error(f"Save message error: {e}", "Niv AI Stream")
 
-            # ── Send done event ──
-            yield _sse({
-                "type": "done", "content": "",
+            # ── Save the turn to DB ──
+            # No liveness probe up front: try the save and only reconnect
+            # and retry if the connection turns out to be gone
+            _turn_args = (conversation_id, _user_message, _user_message_at, user,
+                          full_response, tool_calls_data)
+            _turn_kwargs = {
                 "input_tokens": token_data.get("input_tokens", 0),
                 "output_tokens": token_data.get("output_tokens", 0),
                 "total_tokens": token_data.get("total_tokens", 0),
-            })
-
-    from werkzeug.wrappers import Response
-    return Response(
-        generate(),
-        content_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "X-Accel-Buffering": "no",
-            "Connection": "keep-alive",
-        },
-    )
+                "model": model or getattr(settings, "default_model", None),
+            }
+            try:
+                save_turn(*_turn_args, raise_exception=True, **_turn_kwargs)
+            except Exception as e:
+                if _is_connection_error(e):
+                    _ensure_db(_site_name)
+                    save_turn(*_turn_args, **_turn_kwargs)
+                else:
+                    frappe.log_error(f"Save chat turn error: {e}", "Niv AI Stream")
+            _release_db()
+
+    return _sse_response(generate())
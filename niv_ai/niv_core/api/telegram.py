@@ -21,10 +21,18 @@ import re
 import os
 import tempfile
 import uuid
+from functools import lru_cache
 import requests
 import frappe
 from frappe import _
-from niv_ai.niv_core.api._helpers import save_user_message, save_assistant_message
+from niv_ai.niv_core.api._helpers import save_turn, chunk_text
+from niv_ai.niv_core.utils import get_niv_settings
+from requests.adapters import HTTPAdapter
+
+# One pooled session for api.telegram.org — live streaming edits the same
+# message many times per reply, so keep-alive saves a TLS handshake each call
+_TG_SESSION = requests.Session()
+_TG_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
 
 
 # ═══════════════════════════════════════════════════════════════════════
@@ -79,7 +87,6 @@ def webhook(**kwargs):
                 _send_telegram(chat_id, "❌ No linked account. Please ask your admin to link your Telegram ID.")
                 return {"ok": True}
             conversation_id = _get_or_create_conversation(frappe_user, chat_id)
-            frappe.db.commit()
             # Run voice processing in background
             frappe.enqueue(
                 _process_voice_background,
@@ -119,7 +126,6 @@ def webhook(**kwargs):
             return {"ok": True}
 
         conversation_id = _get_or_create_conversation(frappe_user, chat_id)
-        frappe.db.commit()
 
         # Run agent in background to avoid Telegram webhook timeout (60s)
         frappe.enqueue(
@@ -586,9 +592,8 @@ def _handle_stream(chat_id, text, conversation_id, frappe_user):
     _send_context_buttons(chat_id, full_response, text)
 
     # Save messages
-    save_user_message(conversation_id, text)
-    save_assistant_message(
-        conversation_id, full_response,
+    save_turn(
+        conversation_id, text, user=frappe_user, content=full_response,
         input_tokens=token_data.get("input_tokens", 0),
         output_tokens=token_data.get("output_tokens", 0),
         total_tokens=token_data.get("total_tokens", 0),
@@ -653,9 +658,8 @@ def _handle_batch(chat_id, text, conversation_id, frappe_user):
     # Follow-up buttons
     _send_context_buttons(chat_id, full_response, text)
 
-    save_user_message(conversation_id, text)
-    save_assistant_message(
-        conversation_id, full_response,
+    save_turn(
+        conversation_id, text, user=frappe_user, content=full_response,
         input_tokens=token_data.get("input_tokens", 0),
         output_tokens=token_data.get("output_tokens", 0),
         total_tokens=token_data.get("total_tokens", 0),
@@ -744,9 +748,8 @@ def _handle_voice_message(chat_id, voice, conversation_id, frappe_user, message)
             _send_voice_reply(chat_id, full_response)
 
         # Save messages
-        save_user_message(conversation_id, f"[Voice] {transcript}")
-        save_assistant_message(
-            conversation_id, full_response,
+        save_turn(
+            conversation_id, f"[Voice] {transcript}", user=frappe_user, content=full_response,
             input_tokens=token_data.get("input_tokens", 0),
             output_tokens=token_data.get("output_tokens", 0),
             total_tokens=token_data.get("total_tokens", 0),
@@ -767,7 +770,7 @@ def _download_telegram_file(file_id):
     try:
         # Get file path
         url = f"https://api.telegram.org/bot{token}/getFile"
-        r = requests.post(url, json={"file_id": file_id}, timeout=10)
+        r = _TG_SESSION.post(url, json={"file_id": file_id}, timeout=10)
         if not r.ok:
             return None
 
@@ -777,7 +780,7 @@ def _download_telegram_file(file_id):
 
         # Download file
         download_url = f"https://api.telegram.org/file/bot{token}/{file_path}"
-        r = requests.get(download_url, timeout=30)
+        r = _TG_SESSION.get(download_url, timeout=30)
         if not r.ok:
             return None
 
@@ -1151,7 +1154,7 @@ def _answer_callback(callback_id, text=None):
         payload["text"] = text
 
     try:
-        requests.post(url, json=payload, timeout=5)
+        _TG_SESSION.post(url, json=payload, timeout=5)
     except Exception:
         pass
 
@@ -1376,6 +1379,7 @@ def _get_or_create_conversation(user, chat_id):
         "channel_id": str(chat_id)
     })
     conv.insert(ignore_permissions=True)
+    # Committed here — the webhook hands it to a background job right away
     frappe.db.commit()
     return conv.name
 
@@ -1410,17 +1414,26 @@ def _get_settings():
     """Get Niv Settings (cached per request via frappe.local)."""
     if not hasattr(frappe.local, '_niv_tg_settings'):
         try:
-            frappe.local._niv_tg_settings = frappe.get_doc("Niv Settings", "Niv Settings")
+            frappe.local._niv_tg_settings = get_niv_settings()
         except Exception:
             frappe.local._niv_tg_settings = frappe._dict()
     return frappe.local._niv_tg_settings
 
 
+@lru_cache(maxsize=8)
+def _decrypted_bot_token(site, modified):
+    """Decrypted bot token, memoized per worker — every send/edit needs it.
+
+    Keyed on the settings' ``modified`` so saving a new token takes effect.
+    """
+    return _get_settings().get_password("telegram_bot_token")
+
+
 def _get_bot_token():
     """Get bot token from settings."""
     try:
         settings = _get_settings()
-        return settings.get_password("telegram_bot_token")
+        return _decrypted_bot_token(frappe.local.site, str(settings.modified))
     except Exception:
         return None
 
@@ -1435,11 +1448,11 @@ def _send_telegram(chat_id, text, parse_mode="Markdown"):
     payload = {"chat_id": chat_id, "text": text, "parse_mode": parse_mode}
 
     try:
-        r = requests.post(url, json=payload, timeout=15)
+        r = _TG_SESSION.post(url, json=payload, timeout=15)
         if not r.ok and parse_mode:
             # Retry without parse mode if markdown is invalid
             payload.pop("parse_mode")
-            r = requests.post(url, json=payload, timeout=15)
+            r = _TG_SESSION.post(url, json=payload, timeout=15)
         if r.ok:
             return r.json().get("result", {}).get("message_id")
         return None
@@ -1463,10 +1476,10 @@ def _send_telegram_with_buttons(chat_id, text, buttons, parse_mode="Markdown"):
     }
 
     try:
-        r = requests.post(url, json=payload, timeout=15)
+        r = _TG_SESSION.post(url, json=payload, timeout=15)
         if not r.ok and parse_mode:
             payload.pop("parse_mode")
-            r = requests.post(url, json=payload, timeout=15)
+            r = _TG_SESSION.post(url, json=payload, timeout=15)
         if r.ok:
             return r.json().get("result", {}).get("message_id")
         return None
@@ -1484,7 +1497,7 @@ def _edit_telegram(chat_id, message_id, text, parse_mode="Markdown"):
     payload = {"chat_id": chat_id, "message_id": message_id, "text": text, "parse_mode": parse_mode}
 
     try:
-        r = requests.post(url, json=payload, timeout=10)
+        r = _TG_SESSION.post(url, json=payload, timeout=10)
         if not r.ok:
             error_desc = r.json().get("description", "") if r.text else ""
             # "message is not modified" is not a real error — just same content
@@ -1492,7 +1505,7 @@ def _edit_telegram(chat_id, message_id, text, parse_mode="Markdown"):
                 return True
             if parse_mode:
                 payload.pop("parse_mode")
-                r = requests.post(url, json=payload, timeout=10)
+                r = _TG_SESSION.post(url, json=payload, timeout=10)
         return r.ok
     except Exception:
         return False
@@ -1505,7 +1518,7 @@ def _delete_telegram(chat_id, message_id):
         return
     url = f"https://api.telegram.org/bot{token}/deleteMessage"
     try:
-        requests.post(url, json={"chat_id": chat_id, "message_id": message_id}, timeout=5)
+        _TG_SESSION.post(url, json={"chat_id": chat_id, "message_id": message_id}, timeout=5)
     except Exception:
         pass
 
@@ -1518,19 +1531,7 @@ def _send_long_message(chat_id, text):
         _send_telegram(chat_id, text)
         return
 
-    chunks = []
-    current = ""
-
-    for line in text.split("\n"):
-        if len(current) + len(line) + 1 > MAX_LEN:
-            if current:
-                chunks.append(current)
-            current = line
-        else:
-            current = current + "\n" + line if current else line
-
-    if current:
-        chunks.append(current)
+    chunks = chunk_text(text, MAX_LEN)
 
     for chunk in chunks:
         _send_telegram(chat_id, chunk)
@@ -1544,7 +1545,7 @@ def _send_chat_action(chat_id, action="typing"):
         return
     url = f"https://api.telegram.org/bot{token}/sendChatAction"
     try:
-        requests.post(url, json={"chat_id": chat_id, "action": action}, timeout=5)
+        _TG_SESSION.post(url, json={"chat_id": chat_id, "action": action}, timeout=5)
     except Exception:
         pass
 
@@ -1562,7 +1563,7 @@ def _send_document(chat_id, file_path, filename=None):
         with open(file_path, "rb") as f:
             files = {"document": (filename or os.path.basename(file_path), f)}
             payload = {"chat_id": chat_id}
-            r = requests.post(url, data=payload, files=files, timeout=30)
+            r = _TG_SESSION.post(url, data=payload, files=files, timeout=30)
             if r.ok:
                 return r.json().get("result", {}).get("message_id")
     except Exception as e:
@@ -1588,11 +1589,11 @@ def _send_photo(chat_id, file_path_or_url, caption=None):
 
         if file_path_or_url.startswith("http"):
             payload["photo"] = file_path_or_url
-            r = requests.post(url, json=payload, timeout=15)
+            r = _TG_SESSION.post(url, json=payload, timeout=15)
         else:
             with open(file_path_or_url, "rb") as f:
                 files = {"photo": f}
-                r = requests.post(url, data=payload, files=files, timeout=30)
+                r = _TG_SESSION.post(url, data=payload, files=files, timeout=30)
 
         if r.ok:
             return r.json().get("result", {}).get("message_id")
@@ -1614,7 +1615,7 @@ def _send_voice_file(chat_id, file_path):
         with open(file_path, "rb") as f:
             files = {"voice": (os.path.basename(file_path), f)}
             payload = {"chat_id": chat_id}
-            r = requests.post(url, data=payload, files=files, timeout=30)
+            r = _TG_SESSION.post(url, data=payload, files=files, timeout=30)
             if r.ok:
                 return r.json().get("result", {}).get("message_id")
     except Exception as e:
@@ -1730,7 +1731,7 @@ def setup_webhook():
     # Set allowed updates to include callback_query
     payload["allowed_updates"] = json.dumps(["message", "edited_message", "callback_query"])
 
-    r = requests.post(url, json=payload, timeout=10)
+    r = _TG_SESSION.post(url, json=payload, timeout=10)
     result = r.json()
 
     if result.get("ok"):
@@ -1751,7 +1752,7 @@ def remove_webhook():
         frappe.throw(_("No bot token configured"))
 
     url = f"https://api.telegram.org/bot{token}/deleteWebhook"
-    r = requests.post(url, timeout=10)
+    r = _TG_SESSION.post(url, timeout=10)
     result = r.json()
 
     if result.get("ok"):
@@ -1772,7 +1773,7 @@ def webhook_info():
         return {"error": "No bot token configured"}
 
     url = f"https://api.telegram.org/bot{token}/getWebhookInfo"
-    r = requests.get(url, timeout=10)
+    r = _TG_SESSION.get(url, timeout=10)
     return r.json().get("result", {})
 
 
@@ -1786,7 +1787,7 @@ def bot_info():
         return {"error": "No bot token configured"}
 
     url = f"https://api.telegram.org/bot{token}/getMe"
-    r = requests.get(url, timeout=10)
+    r = _TG_SESSION.get(url, timeout=10)
     return r.json().get("result", {})
 
 
@@ -1813,7 +1814,7 @@ def set_bot_commands():
     ]
 
     url = f"https://api.telegram.org/bot{token}/setMyCommands"
-    r = requests.post(url, json={"commands": commands}, timeout=10)
+    r = _TG_SESSION.post(url, json={"commands": commands}, timeout=10)
     result = r.json()
 
     if result.get("ok"):
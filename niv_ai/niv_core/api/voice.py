@@ -4,6 +4,7 @@ import json
 import os
 import re
 import uuid
+import shutil
 import subprocess
 import tempfile
 
@@ -238,6 +239,33 @@ def _escape_ssml(text):
     return text
 
 
+# Sentiment keywords/prosody table — built once, not per TTS call
+_ERROR_WORDS = frozenset({
+    "sorry", "unfortunately", "error", "failed", "issue", "problem",
+    "apologize", "couldn't", "can't", "unable", "mistake", "wrong",
+    "maaf", "galat", "samasya",
+})
+_HAPPY_WORDS = frozenset({
+    "great", "excellent", "awesome", "wonderful", "fantastic",
+    "congratulations", "perfect", "amazing", "success", "happy",
+    "bahut accha", "badhai", "shaandar", "zabardast",
+})
+_SAD_WORDS = frozenset({
+    "sad", "disappointed", "loss", "difficult", "hard time",
+    "dukh", "mushkil",
+})
+_NUMBER_RE = re.compile(r'\d+')
+
+_PROSODY_PARAMS = {
+    "happy": {"rate": "+8%", "pitch": "+5%"},
+    "sad": {"rate": "-8%", "pitch": "-5%"},
+    "error": {"rate": "-10%", "pitch": "-8%"},
+    "question": {"rate": "+0%", "pitch": "+3%"},
+    "data": {"rate": "-5%", "pitch": "+0%"},
+    "neutral": {"rate": "+0%", "pitch": "+0%"},
+}
+
+
 def _detect_sentiment(text):
     """Simple rule-based sentiment detection for prosody adjustment.
     Returns: 'happy', 'sad', 'error', 'question', 'data', 'neutral'
@@ -245,10 +273,7 @@ def _detect_sentiment(text):
     text_lower = text.lower()
 
     # Error/apology patterns
-    error_words = ["sorry", "unfortunately", "error", "failed", "issue", "problem",
-                   "apologize", "couldn't", "can't", "unable", "mistake", "wrong",
-                   "maaf", "galat", "samasya"]
-    if any(w in text_lower for w in error_words):
+    if any(w in text_lower for w in _ERROR_WORDS):
         return "error"
 
     # Question detection
@@ -256,22 +281,17 @@ def _detect_sentiment(text):
         return "question"
 
     # Data/numbers heavy text
-    number_count = len(re.findall(r'\d+', text))
+    number_count = len(_NUMBER_RE.findall(text))
     word_count = max(len(text.split()), 1)
     if number_count / word_count > 0.3:
         return "data"
 
     # Happy/excited patterns
-    happy_words = ["great", "excellent", "awesome", "wonderful", "fantastic",
-                   "congratulations", "perfect", "amazing", "success", "happy",
-                   "bahut accha", "badhai", "shaandar", "zabardast"]
-    if any(w in text_lower for w in happy_words) or text.count("!") >= 2:
+    if any(w in text_lower for w in _HAPPY_WORDS) or text.count("!") >= 2:
         return "happy"
 
     # Sad/negative
-    sad_words = ["sad", "disappointed", "loss", "difficult", "hard time",
-                 "dukh", "mushkil"]
-    if any(w in text_lower for w in sad_words):
+    if any(w in text_lower for w in _SAD_WORDS):
         return "sad"
 
     return "neutral"
@@ -279,15 +299,7 @@ def _detect_sentiment(text):
 
 def _get_prosody_params(sentiment):
     """Return SSML prosody rate and pitch based on sentiment."""
-    params = {
-        "happy": {"rate": "+8%", "pitch": "+5%"},
-        "sad": {"rate": "-8%", "pitch": "-5%"},
-        "error": {"rate": "-10%", "pitch": "-8%"},
-        "question": {"rate": "+0%", "pitch": "+3%"},
-        "data": {"rate": "-5%", "pitch": "+0%"},
-        "neutral": {"rate": "+0%", "pitch": "+0%"},
-    }
-    return params.get(sentiment, params["neutral"])
+    return _PROSODY_PARAMS.get(sentiment, _PROSODY_PARAMS["neutral"])
 
 
 def _add_ssml_breaks_and_emphasis(text):
@@ -513,9 +525,12 @@ def _get_piper_model_path(voice_name):
         frappe.logger().info(f"Downloading Piper voice model: {voice_name}")
         resp = requests.get(model_url, stream=True, timeout=120)
         resp.raise_for_status()
+        # Models are tens of MB — copy in 1 MiB reads straight off the raw
+        # stream (decode_content keeps gzip/deflate handling) instead of
+        # 8 KiB iter_content chunks
+        resp.raw.decode_content = True
         with open(model_path, "wb") as f:
-            for chunk in resp.iter_content(chunk_size=8192):
-                f.write(chunk)
+            shutil.copyfileobj(resp.raw, f, 1024 * 1024)
 
         resp = requests.get(config_url, timeout=30)
         resp.raise_for_status()
@@ -16,6 +16,7 @@ import time
 import requests
 import frappe
 from niv_ai.niv_core.utils import get_niv_settings
+from niv_ai.niv_core.api._helpers import chunk_text
 from frappe import _
 
 
@@ -317,17 +318,7 @@ def _send_long_message(to, text):
         _send_whatsapp(to, text)
         return
 
-    chunks = []
-    current = ""
-    for line in text.split("\n"):
-        if len(current) + len(line) + 1 > MAX_LEN:
-            if current:
-                chunks.append(current)
-            current = line
-        else:
-            current = current + "\n" + line if current else line
-    if current:
-        chunks.append(current)
+    chunks = chunk_text(text, MAX_LEN)
 
     for chunk in chunks:
         _send_whatsapp(to, chunk)
@@ -15,6 +15,12 @@ class NivConversation(Document):
             settings = frappe.get_single("Niv Settings")
             self.system_prompt = settings.system_prompt
 
+    def on_update(self):
+        # Shared views show the title
+        from niv_ai.niv_core.api.conversation import evict_conversation_shares
+
+        evict_conversation_shares(self.name)
+
 
 def has_permission(doc, ptype="read", user=None):
     """Users can only access their own conversations. System Manager can access all."""
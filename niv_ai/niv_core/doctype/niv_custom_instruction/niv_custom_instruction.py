@@ -9,3 +9,33 @@ class NivCustomInstruction(Document):
 
         if self.scope == "Per User" and not self.user:
             self.user = frappe.session.user
+
+    def on_update(self):
+        self.clear_prompt_cache()
+
+    def on_trash(self):
+        self.clear_prompt_cache()
+
+    def clear_prompt_cache(self):
+        from niv_ai.niv_core.api.instructions import clear_instructions_cache
+
+        # Global instructions are part of every user's prompt
+        before = self.get_doc_before_save()
+        if self.scope == "Global" or (before and before.scope == "Global"):
+            users = [None]
+        else:
+            users = [self.user]
+            if before and before.user and before.user != self.user:
+                users.append(before.user)
+
+        def clear():
+            for user in users:
+                clear_instructions_cache(user)
+
+        # Clear once the change is committed — clearing earlier lets a
+        # concurrent prompt build re-cache the old rows for the full TTL
+        after_commit = getattr(frappe.db, "after_commit", None)
+        if after_commit is not None:
+            after_commit.add(clear)
+        else:
+            clear()
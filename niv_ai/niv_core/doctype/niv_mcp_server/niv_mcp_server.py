@@ -1,10 +1,10 @@
 # Copyright (c) 2026, Niv AI
 # Niv MCP Server DocType
 
-import json
 import frappe
 from frappe import _
 from frappe.utils import now_datetime
+from niv_ai.niv_core.utils import fast_json
 
 
 class NivMCPServer(frappe.model.document.Document):
@@ -23,26 +23,29 @@ class NivMCPServer(frappe.model.document.Document):
             pass
 
 
-@frappe.whitelist()
+@frappe.whitelist(methods=["POST"])
 def test_connection(server_name):
     """Test connection to an MCP server and discover tools."""
-    doc = frappe.get_doc("Niv MCP Server", server_name)
-    if not doc.is_active:
+    is_active = frappe.db.get_value("Niv MCP Server", server_name, "is_active")
+    if is_active is None:
+        frappe.throw(_("MCP Server {0} not found").format(server_name), frappe.DoesNotExistError)
+    if not is_active:
         frappe.throw(_("Server is not active"))
 
     try:
         from niv_ai.niv_core.mcp_client import discover_tools
         tools = discover_tools(server_name, use_cache=False)
 
-        # Update doc with results
-        doc.tools_count = len(tools)
-        doc.last_connected = now_datetime()
-        doc.tools_discovered_json = json.dumps(
-            [{"name": t.get("name", ""), "description": t.get("description", "")[:100]} for t in tools],
-            indent=2
-        )
-        doc.save(ignore_permissions=True)
-        frappe.db.commit()
+        # Status fields only — a single UPDATE, and no on_update hook wiping
+        # the tool cache that discover_tools just filled
+        frappe.db.set_value("Niv MCP Server", server_name, {
+            "tools_count": len(tools),
+            "last_connected": now_datetime(),
+            "tools_discovered_json": fast_json.dumps_str(
+                [{"name": t.get("name", ""), "description": t.get("description", "")[:100]} for t in tools],
+                indent=True,
+            ),
+        })
 
         tool_names = [t.get("name", "") for t in tools]
         return {
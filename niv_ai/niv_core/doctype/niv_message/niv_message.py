@@ -12,6 +12,18 @@ class NivMessage(Document):
                 last_message_at = NOW()
             WHERE name = %s
         """, (self.total_tokens or 0, self.conversation))
+        self.clear_share_cache()
+
+    def on_update(self):
+        self.clear_share_cache()
+
+    def on_trash(self):
+        self.clear_share_cache()
+
+    def clear_share_cache(self):
+        from niv_ai.niv_core.api.conversation import evict_conversation_shares
+
+        evict_conversation_shares(self.conversation)
 
 
 def has_permission(doc, ptype="read", user=None):
@@ -5,4 +5,17 @@
 from frappe.model.document import Document
 
 class NivPairingCode(Document):
-	pass
+	def on_update(self):
+		self.clear_token_cache()
+
+	def on_trash(self):
+		self.clear_token_cache()
+
+	def clear_token_cache(self):
+		from niv_ai.niv_core.api.mobile import _evict_token
+
+		# An expired/removed device must stop verifying in every worker
+		_evict_token(self.api_key)
+		before = self.get_doc_before_save()
+		if before and before.api_key != self.api_key:
+			_evict_token(before.api_key)
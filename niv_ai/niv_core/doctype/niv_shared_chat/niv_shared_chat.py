@@ -3,4 +3,17 @@ from frappe.model.document import Document
 
 
 class NivSharedChat(Document):
-    pass
+    def on_update(self):
+        self.clear_share_cache()
+
+    def on_trash(self):
+        self.clear_share_cache()
+
+    def clear_share_cache(self):
+        from niv_ai.niv_core.api.conversation import _evict_shared_chat
+
+        # A deactivated/removed share must stop serving its cached messages
+        _evict_shared_chat(self.share_hash)
+        before = self.get_doc_before_save()
+        if before and before.share_hash != self.share_hash:
+            _evict_shared_chat(before.share_hash)
@@ -10,6 +10,7 @@ Two-model optimization:
 """
 import json
 import re
+from concurrent.futures import ThreadPoolExecutor
 import frappe
 from niv_ai.niv_core.utils import get_niv_settings
 from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
@@ -43,6 +44,19 @@ _TAG_OPENERS = [
     ('[[THINKING]]', '[[/THINKING]]'),
 ]
 
+# Content capture per opener — compiled once, used on every streamed chunk
+_TAG_CAPTURE_PATTERNS = [
+    (opener, re.compile(re.escape(opener) + r'([\s\S]*?)' + re.escape(closer)))
+    for opener, closer in _TAG_OPENERS
+]
+
+_BLANK_LINES_RE = re.compile(r'\n{3,}')
+
+# Single tool results shorter than this are shown directly instead of
+# re-running the agent when the two-model path produced no text
+_SMALL_RESULT_CHARS = 500
+_GARBLED_TOOL_RE = re.compile(r'^[a-z][a-z0-9_]+\s*\S*\s*\{')
+
 
 # ─── Helpers ────────────────────────────────────────────────────────
 
@@ -70,7 +84,7 @@ def _strip_thinking(text, final=False):
         return text
     for pattern, repl in _THINKING_PATTERNS:
         text = pattern.sub(repl, text)
-    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = _BLANK_LINES_RE.sub('\n\n', text)
     return text.strip() if final else text
 
 
@@ -83,10 +97,9 @@ def _extract_thinking(text):
         return "", text
     
     thinking_parts = []
-    for opener, closer in _TAG_OPENERS:
-        escaped_opener = re.escape(opener)
-        escaped_closer = re.escape(closer)
-        pattern = re.compile(escaped_opener + r'([\s\S]*?)' + escaped_closer)
+    for opener, pattern in _TAG_CAPTURE_PATTERNS:
+        if opener not in text:
+            continue
         for match in pattern.finditer(text):
             thought = match.group(1).strip()
             if thought:
@@ -131,7 +144,7 @@ def _is_garbled_tool_text(text):
         return False
     # Pattern: function_name + optional garbage + JSON object
     # Real responses don't start with a snake_case word followed by {
-    if re.match(r'^[a-z][a-z0-9_]+\s*\S*\s*\{', stripped):
+    if _GARBLED_TOOL_RE.match(stripped):
         # Verify there's a JSON-like structure
         brace_start = stripped.find('{')
         if brace_start >= 0:
@@ -175,7 +188,6 @@ def _build_messages(message: str, conversation_id: str = None, system_prompt: st
                 if processed.get("text_context"):
                     message = message + "\n\n" + processed["text_context"]
                 
-                from niv_ai.niv_core.utils import get_niv_settings
                 _vs = get_niv_settings()
                 if getattr(_vs, "enable_vision", 0) and getattr(_vs, "vision_model", None):
                     from niv_ai.niv_core.langchain.llm import call_vision
@@ -450,7 +462,7 @@ def _stream_single_model(agent, messages, config, cbs, dev_mode=False, max_tool_
     This is the reliable path — the agent handles tool selection, execution,
     retries with corrected args, and multi-step reasoning automatically.
     """
-    pending_tool_calls = {}
+    pending_tool_calls = []  # indexed by tool_call_chunk index
     tool_call_count = 0
     start_ts = frappe.utils.now_datetime()
     buffer = ""
@@ -498,9 +510,9 @@ def _stream_single_model(agent, messages, config, cbs, dev_mode=False, max_tool_
                         yield {"type": "tool_call", "tool": tc.get("name", ""), "arguments": tc.get("args", {})}
                 else:
                     for tc in tool_call_chunks:
-                        idx = tc.get("index", 0)
-                        if idx not in pending_tool_calls:
-                            pending_tool_calls[idx] = {"name": "", "args": ""}
+                        idx = tc.get("index") or 0
+                        while len(pending_tool_calls) <= idx:
+                            pending_tool_calls.append({"name": "", "args": ""})
                         if tc.get("name"):
                             pending_tool_calls[idx]["name"] = tc["name"]
                         if tc.get("args"):
@@ -511,8 +523,7 @@ def _stream_single_model(agent, messages, config, cbs, dev_mode=False, max_tool_
             tool_call_count += 1
 
             # Emit any pending tool call chunks
-            for idx in sorted(pending_tool_calls.keys()):
-                tc_data = pending_tool_calls[idx]
+            for tc_data in pending_tool_calls:
                 if tc_data["name"]:
                     yield {"type": "tool_call", "tool": tc_data["name"], "arguments": _parse_tc_args(tc_data["args"])}
             pending_tool_calls.clear()
@@ -555,8 +566,6 @@ def _stream_two_model(
       - Fast model outputs garbled tool text instead of proper function calls
       - All tool calls fail (single-model can retry with corrected args)
     """
-    from .tools import get_langchain_tools
-
     fast_model_name = _get_fast_model()
     tools = get_langchain_tools()
 
@@ -610,7 +619,6 @@ def _stream_two_model(
         return {"tool_call_id": tool_call_id, "tool_name": tool_name, "result": result_str}
 
     if len(calls) >= 2:
-        from concurrent.futures import ThreadPoolExecutor
         with ThreadPoolExecutor(max_workers=min(len(calls), 4)) as pool:
             tool_results = list(pool.map(_exec_one, calls))
     else:
@@ -707,8 +715,7 @@ def _stream_two_model(
             yield {"type": "tool_call", "tool": tc["name"], "arguments": tc["args"]}
 
         # Build AI message for the chain
-        from langchain_core.messages import AIMessage as _AIMsg
-        chain_ai_msg = _AIMsg(
+        chain_ai_msg = AIMessage(
             content=collected_text,
             tool_calls=[{"name": tc["name"], "args": tc["args"], "id": tc.get("id", f"call_{tc['name']}")} for tc in chain_tool_calls],
         )
@@ -727,6 +734,33 @@ def _stream_two_model(
         frappe.logger().info(f"Niv AI: Chain round {chain_round + 1}, {len(chain_tool_calls)} extra tool(s)")
 
 
+def _format_small_tool_result(tool_name, result):
+    """Render one short tool result as markdown, or None if it needs the LLM.
+
+    Used when the two-model path ran a tool but produced no text — for a
+    small, successful result this replaces re-running the whole agent.
+    """
+    if not result or len(result) >= _SMALL_RESULT_CHARS:
+        return None
+    stripped = result.strip()
+    if stripped.lower().startswith(("error", "tool '")) or '"error"' in stripped[:50]:
+        return None
+    try:
+        data = json.loads(stripped)
+    except (json.JSONDecodeError, TypeError):
+        data = stripped
+
+    if isinstance(data, dict) and data:
+        body = "\n".join(f"- **{k}**: {v}" for k, v in data.items())
+    elif isinstance(data, list) and data and all(not isinstance(x, (dict, list)) for x in data):
+        body = "\n".join(f"- {x}" for x in data)
+    elif isinstance(data, str):
+        body = data
+    else:
+        return None
+    return f"Here's what `{tool_name}` returned:\n\n{body}"
+
+
 # ─── Main Entry Point ──────────────────────────────────────────────
 
 def stream_agent(
@@ -782,7 +816,7 @@ def stream_agent(
     try:
         if use_two_model:
             fell_back = False
-            two_model_events = []  # Buffer events in case we need to fall back
+            tool_results = []
             
             for event in _stream_two_model(
                 message=message,
@@ -803,9 +837,21 @@ def stream_agent(
                 # Track if we yielded any real text tokens
                 if event.get("type") == "token":
                     yielded_any_token = True
-                
+                elif event.get("type") == "tool_result":
+                    tool_results.append(event)
+
                 yield event
-            
+
+            # Tools ran but no text: a single small result can be shown as-is
+            # instead of paying for a full single-model re-run
+            if not fell_back and not yielded_any_token and len(tool_results) == 1:
+                local_text = _format_small_tool_result(
+                    tool_results[0].get("tool", ""), tool_results[0].get("result", "")
+                )
+                if local_text:
+                    yielded_any_token = True
+                    yield {"type": "token", "content": local_text}
+
             if fell_back or not yielded_any_token:
                 # Single-model gets fresh start — it will re-discover and call tools itself
                 # Also falls back when two-model produced tools but no text (garbled output)
@@ -837,15 +883,19 @@ def stream_agent(
             except Exception:
                 pass
         
-        # Build full prompt text for accurate token estimation
-        def _content_to_str(c):
-            if isinstance(c, list):
-                return " ".join(p.get("text","") if isinstance(p,dict) else str(p) for p in c)
-            return str(c) if c else ""
-        full_prompt = "\n".join(
-            _content_to_str(getattr(m, "content", str(m))) for m in messages if hasattr(m, "content")
-        )
-        cbs["billing"].finalize(stream_cb=cbs["stream"], full_prompt_text=full_prompt)
+        # Build full prompt text for token estimation — only needed when
+        # the provider reported no usage (finalize ignores it otherwise)
+        full_prompt = None
+        billing = cbs["billing"]
+        if not billing.total_prompt_tokens and not billing.total_completion_tokens:
+            def _content_to_str(c):
+                if isinstance(c, list):
+                    return " ".join(p.get("text","") if isinstance(p,dict) else str(p) for p in c)
+                return str(c) if c else ""
+            full_prompt = "\n".join(
+                _content_to_str(getattr(m, "content", str(m))) for m in messages if hasattr(m, "content")
+            )
+        billing.finalize(stream_cb=cbs["stream"], full_prompt_text=full_prompt)
         cbs["logging"].finalize()
         
         # Yield token usage for stream.py to capture
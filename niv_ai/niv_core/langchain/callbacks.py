@@ -4,6 +4,7 @@ All side effects handled via callback hooks — clean separation.
 """
 import json
 import time
+from functools import lru_cache
 import frappe
 from niv_ai.niv_core.utils import get_niv_settings
 from langchain_core.callbacks import BaseCallbackHandler
@@ -11,16 +12,27 @@ from typing import Any, Dict, List, Optional
 from uuid import UUID
 
 
+@lru_cache(maxsize=1)
+def _get_encoder():
+    """cl100k_base encoder, loaded once per worker (None if tiktoken is unavailable)."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        return None
+
+
 def _estimate_token_count(text):
     """BUG-011: Try tiktoken for accurate count, fallback to ~4 chars/token."""
     if not text:
         return 1
-    try:
-        import tiktoken
-        enc = tiktoken.get_encoding("cl100k_base")
-        return len(enc.encode(text))
-    except Exception:
-        return max(1, len(text) // 4)
+    enc = _get_encoder()
+    if enc is not None:
+        try:
+            return len(enc.encode_ordinary(text))
+        except Exception:
+            pass
+    return max(1, len(text) // 4)
 
 
 class NivStreamingCallback(BaseCallbackHandler):
@@ -37,6 +37,15 @@ def _detect_provider_type(base_url: str, provider_name: str) -> str:
     return "openai"
 
 
+@lru_cache(maxsize=32)
+def _provider_api_key(site, provider_name, modified):
+    """Decrypted provider API key, memoized per worker.
+
+    Keyed on the provider's ``modified`` so saving a new key takes effect.
+    """
+    return frappe.get_cached_doc("Niv AI Provider", provider_name).get_password("api_key")
+
+
 def get_llm(provider_name=None, model=None, streaming=True, callbacks=None):
     """Create LangChain LLM from Niv AI Provider settings.
 
@@ -51,14 +60,14 @@ def get_llm(provider_name=None, model=None, streaming=True, callbacks=None):
     if not provider_name:
         frappe.throw("No AI provider configured. Set default_provider in Niv Settings.")
 
-    provider = frappe.get_doc("Niv AI Provider", provider_name)
+    provider = frappe.get_cached_doc("Niv AI Provider", provider_name)
     # Get API key — auto-refresh OAuth tokens if expired
     auth_type = getattr(provider, "auth_type", "API Key") or "API Key"
     if auth_type in ("Setup Token", "ChatGPT Login") and getattr(provider, "refresh_token", None):
         from niv_ai.niv_core.api.oauth import refresh_if_needed
         api_key = refresh_if_needed(provider_name)
     else:
-        api_key = provider.get_password("api_key")
+        api_key = _provider_api_key(frappe.local.site, provider_name, str(provider.modified))
     
     model = model or provider.default_model or settings.default_model
 
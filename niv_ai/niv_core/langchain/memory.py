@@ -322,12 +322,15 @@ def get_system_prompt(conversation_id: str = None) -> str:
     # Try conversation-level prompt
     if conversation_id:
         try:
-            conv = frappe.get_doc("Niv Conversation", conversation_id)
-            if hasattr(conv, "system_prompt") and conv.system_prompt:
-                if frappe.db.exists("Niv System Prompt", conv.system_prompt):
-                    prompt_doc = frappe.get_doc("Niv System Prompt", conv.system_prompt)
-                    if prompt_doc.content:
-                        return prompt_doc.content
+            # One query; returns nothing for the usual case of no per-chat prompt
+            content = frappe.db.sql("""
+                SELECT p.content
+                FROM `tabNiv Conversation` c
+                JOIN `tabNiv System Prompt` p ON p.name = c.system_prompt
+                WHERE c.name = %s
+            """, conversation_id)
+            if content and content[0][0]:
+                return content[0][0]
         except Exception:
             pass
 
@@ -17,7 +17,9 @@ from langchain_core.tools import StructuredTool
 from pydantic import create_model, Field
 from typing import Any, Optional
 
+from niv_ai.niv_core.utils import fast_json
 from niv_ai.niv_core.mcp_client import (
+    _cache_generation,
     get_all_mcp_tools_cached,
     find_tool_server,
     call_tool_fast,
@@ -240,14 +242,14 @@ def _execute_single_tool(tool_name, arguments):
                     if isinstance(c, dict) and c.get("type") == "text":
                         text_parts.append(c.get("text", ""))
                     elif isinstance(c, dict):
-                        text_parts.append(json.dumps(c, default=str))
+                        text_parts.append(fast_json.dumps_str(c))
                     else:
                         text_parts.append(str(c))
                 return "\n".join(text_parts)
         
         # BUG-012: Ensure result is always a string for the LLM
         if isinstance(result, (dict, list)):
-            return json.dumps(result, default=str, ensure_ascii=False)
+            return fast_json.dumps_str(result)
         return str(result)
     except Exception as e:
         return json.dumps({"error": f"Tool '{tool_name}' failed: {str(e)}"})
@@ -740,21 +742,25 @@ def _make_mcp_executor(tool_name: str, input_schema: dict = None):
                         if isinstance(c, dict) and c.get("type") == "text":
                             text_parts.append(c.get("text", ""))
                         elif isinstance(c, dict):
-                            text_parts.append(json.dumps(c, default=str))
+                            text_parts.append(fast_json.dumps_str(c))
                         else:
                             text_parts.append(str(c))
                     result_text = "\n".join(text_parts)
 
+            result_data = None
             if result_text is None:
                 # BUG-012: Ensure result is always a string for the LLM
                 if isinstance(result, (dict, list)):
-                    result_text = json.dumps(result, default=str, ensure_ascii=False)
+                    result_text = fast_json.dumps_str(result)
+                    result_data = result
                 else:
                     result_text = str(result)
 
             # ── Post-process: Summarize large results + add next-step hints ──
+            # A structured result is summarized from the dict itself rather
+            # than re-parsing the JSON just encoded from it
             from niv_ai.niv_core.tools.result_processor import post_process_result, add_next_steps
-            result_text = post_process_result(tool_name, result_text)
+            result_text = post_process_result(tool_name, result_text, data=result_data)
             result_text = add_next_steps(tool_name, result_text)
 
             # Cache read-only tool results
@@ -779,7 +785,7 @@ def _make_mcp_executor(tool_name: str, input_schema: dict = None):
 
 
 # Tool list cache (avoids rebuilding LangChain wrappers every call)
-_lc_tools_cache = {"tools": [], "expires": 0}
+_lc_tools_cache = {"tools": [], "expires": 0, "gen": None}
 _LC_CACHE_TTL = 300  # 5 min, matches mcp_client
 
 
@@ -825,7 +831,11 @@ def get_langchain_tools() -> list:
     """Get all MCP tools as LangChain StructuredTool objects. Cached."""
     import time
 
-    if _lc_tools_cache["expires"] > time.time() and _lc_tools_cache["tools"]:
+    # Same generation token as the MCP tool caches — an MCP clear_cache() in
+    # any worker rebuilds these too instead of serving them until the TTL
+    gen = _cache_generation()
+    if (_lc_tools_cache["expires"] > time.time() and _lc_tools_cache["tools"]
+            and _lc_tools_cache["gen"] == gen):
         return _lc_tools_cache["tools"]
 
     mcp_tools = get_all_mcp_tools_cached()
@@ -867,6 +877,7 @@ def get_langchain_tools() -> list:
 
     _lc_tools_cache["tools"] = lc_tools
     _lc_tools_cache["expires"] = time.time() + _LC_CACHE_TTL
+    _lc_tools_cache["gen"] = gen
 
     # Add built-in memory tool
     try:
@@ -25,6 +25,7 @@ from typing import Any, Dict, List, Optional
 CACHE_TTL = 300  # 5 min worker memory
 REDIS_CACHE_TTL = 600  # 10 min Redis
 REDIS_KEY_PREFIX = "niv_mcp_tools:"
+GENERATION_CHECK_INTERVAL = 1  # sec between Redis reads of the cache generation
 
 
 class MCPError(Exception):
@@ -85,6 +86,7 @@ _cache_lock = threading.Lock()
 _tools_cache = {}  # server_name -> {"tools": [...], "expires": ts}
 _tool_index = {}  # tool_name -> server_name
 _tool_index_expires = 0
+_tool_index_gen = None
 _openai_tools_cache = {"tools": [], "expires": 0}
 # Track which servers are same-server (avoid re-detecting every call)
 _same_server_cache = {}  # server_name -> bool
@@ -117,6 +119,29 @@ def _redis_get(key):
         return None
 
 
+# site -> (generation token, time.monotonic() it was read)
+_generation_seen = {}
+
+
+def _cache_generation():
+    """Shared token that clear_cache() replaces in Redis.
+
+    Worker-memory entries remember the token they were built under, so a
+    clear in one worker invalidates the memory copies in every worker
+    instead of leaving them stale until CACHE_TTL runs out. The token itself
+    is re-read from Redis at most once per GENERATION_CHECK_INTERVAL, so a
+    memory-cache hit doesn't cost a Redis round-trip.
+    """
+    site = getattr(frappe.local, "site", None)
+    now = time.monotonic()
+    seen = _generation_seen.get(site)
+    if seen and now - seen[1] < GENERATION_CHECK_INTERVAL:
+        return seen[0]
+    gen = _redis_get("generation")
+    _generation_seen[site] = (gen, now)
+    return gen
+
+
 # ─── Same-Server Detection ────────────────────────────────────────
 
 def _is_same_server(server_name, url):
@@ -337,12 +362,18 @@ def _get_event_loop():
         return _loop
 
 
-def _run_async(coro):
+def _run_async(coro, timeout=120):
     """Run an async coroutine from sync code. Thread-safe."""
     import asyncio
+    from concurrent.futures import TimeoutError as FutureTimeoutError
     loop = _get_event_loop()
     future = asyncio.run_coroutine_threadsafe(coro, loop)
-    return future.result(timeout=120)
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeoutError:
+        # Don't leave the session running on the loop after giving up
+        future.cancel()
+        raise
 
 
 def _build_connection_config(doc):
@@ -431,10 +462,10 @@ async def _sdk_call_tool_async(connection_config, tool_name, arguments):
     raise last_err
 
 
-def _sdk_list_tools(doc):
+def _sdk_list_tools(doc, timeout=120):
     """Sync wrapper for SDK tool discovery."""
     conn = _build_connection_config(doc)
-    return _run_async(_sdk_list_tools_async(conn))
+    return _run_async(_sdk_list_tools_async(conn), timeout=timeout)
 
 
 def _sdk_call_tool(doc, tool_name, arguments, user_api_key=None):
@@ -509,9 +540,11 @@ def get_all_active_servers():
     return []
 
 
-def discover_tools(server_name, use_cache=True):
+def discover_tools(server_name, use_cache=True, timeout=120):
     """Discover tools from an MCP server.
 
+    timeout bounds live SDK discovery, in seconds.
+
     Resolution:
     1. Check if server is active (from DocType)
     2. Worker memory cache
@@ -530,18 +563,20 @@ def discover_tools(server_name, use_cache=True):
     except Exception:
         pass
 
+    gen = _cache_generation()
+
     # 1. Worker cache
     if use_cache:
         with _cache_lock:
             cached = _tools_cache.get(server_name)
-            if cached and cached["expires"] > time.time():
+            if cached and cached["expires"] > time.time() and cached["gen"] == gen:
                 return cached["tools"]
 
     # 2. Redis cache
     redis_tools = _redis_get(f"tools:{server_name}")
     if redis_tools:
         with _cache_lock:
-            _tools_cache[server_name] = {"tools": redis_tools, "expires": time.time() + CACHE_TTL}
+            _tools_cache[server_name] = {"tools": redis_tools, "expires": time.time() + CACHE_TTL, "gen": gen}
         return redis_tools
 
     # 3. Live discovery
@@ -564,7 +599,7 @@ def discover_tools(server_name, use_cache=True):
         # SDK fallback for same-server (if direct failed)
         if not tools and _check_sdk():
             try:
-                tools = _sdk_list_tools(doc)
+                tools = _sdk_list_tools(doc, timeout=timeout)
                 frappe.logger().info(f"Niv MCP: SDK discovery got {len(tools)} tools for '{server_name}'")
             except Exception as e:
                 frappe.logger().warning(f"Niv MCP: SDK discovery also failed for '{server_name}': {e}")
@@ -572,7 +607,7 @@ def discover_tools(server_name, use_cache=True):
         # ── REMOTE: SDK (if available) ──
         if _check_sdk():
             try:
-                tools = _sdk_list_tools(doc)
+                tools = _sdk_list_tools(doc, timeout=timeout)
             except Exception as e:
                 frappe.logger().error(f"Niv MCP: SDK discovery failed for '{server_name}': {e}")
 
@@ -583,7 +618,7 @@ def discover_tools(server_name, use_cache=True):
     # Cache results — NEVER cache empty tools (would hide real tools for 5 min)
     if tools:
         with _cache_lock:
-            _tools_cache[server_name] = {"tools": tools, "expires": time.time() + CACHE_TTL}
+            _tools_cache[server_name] = {"tools": tools, "expires": time.time() + CACHE_TTL, "gen": gen}
         _redis_set(f"tools:{server_name}", tools)
     else:
         frappe.logger().error(f"Niv MCP: 0 tools discovered for '{server_name}' — NOT caching empty result")
@@ -593,13 +628,15 @@ def discover_tools(server_name, use_cache=True):
 
 def _rebuild_tool_index():
     """Rebuild tool_name → server_name index."""
-    global _tool_index, _tool_index_expires
+    global _tool_index, _tool_index_expires, _tool_index_gen
 
+    gen = _cache_generation()
     redis_index = _redis_get("tool_index")
     if redis_index:
         with _cache_lock:
             _tool_index = redis_index
             _tool_index_expires = time.time() + CACHE_TTL
+            _tool_index_gen = gen
         return
 
     new_index = {}
@@ -615,6 +652,7 @@ def _rebuild_tool_index():
     with _cache_lock:
         _tool_index = new_index
         _tool_index_expires = time.time() + CACHE_TTL
+        _tool_index_gen = gen
 
     if new_index:
         _redis_set("tool_index", new_index)
@@ -622,9 +660,9 @@ def _rebuild_tool_index():
 
 def find_tool_server(tool_name):
     """Find which MCP server hosts this tool."""
-    global _tool_index_expires
+    gen = _cache_generation()
     with _cache_lock:
-        if _tool_index_expires > time.time() and tool_name in _tool_index:
+        if _tool_index_expires > time.time() and _tool_index_gen == gen and tool_name in _tool_index:
             return _tool_index[tool_name]
     _rebuild_tool_index()
     with _cache_lock:
@@ -713,14 +751,16 @@ def get_all_mcp_tools_cached():
     except Exception:
         pass
 
+    gen = _cache_generation()
     with _cache_lock:
-        if _openai_tools_cache["expires"] > time.time() and _openai_tools_cache["tools"]:
-            return _openai_tools_cache["tools"]
+        cached = _openai_tools_cache
+        if cached["expires"] > time.time() and cached.get("gen") == gen and cached["tools"]:
+            return cached["tools"]
 
     redis_tools = _redis_get("openai_tools")
     if redis_tools:
         with _cache_lock:
-            _openai_tools_cache = {"tools": redis_tools, "expires": time.time() + CACHE_TTL}
+            _openai_tools_cache = {"tools": redis_tools, "expires": time.time() + CACHE_TTL, "gen": gen}
         return redis_tools
 
     result = []
@@ -749,7 +789,7 @@ def get_all_mcp_tools_cached():
 
     if result:
         with _cache_lock:
-            _openai_tools_cache = {"tools": result, "expires": time.time() + CACHE_TTL}
+            _openai_tools_cache = {"tools": result, "expires": time.time() + CACHE_TTL, "gen": gen}
         _redis_set("openai_tools", result)
         _rebuild_tool_index()
 
@@ -801,13 +841,13 @@ def clear_cache(server_name=None):
         _tool_index_expires = 0
         _openai_tools_cache = {"tools": [], "expires": 0}
     # Clear FAC server cache (force re-import on next call)
-    # Clear Redis
+    # Clear Redis — the combined tool list and index depend on every server
     try:
+        for key in ("openai_tools", "tool_index"):
+            frappe.cache().delete_value(f"{REDIS_KEY_PREFIX}{key}")
         if server_name:
             frappe.cache().delete_value(f"{REDIS_KEY_PREFIX}tools:{server_name}")
         else:
-            for key in ("openai_tools", "tool_index"):
-                frappe.cache().delete_value(f"{REDIS_KEY_PREFIX}{key}")
             # Clear all server tool caches
             try:
                 for sn in get_all_active_servers():
@@ -816,6 +856,10 @@ def clear_cache(server_name=None):
                 pass
     except Exception:
         pass
+    # Invalidate the memory caches of all other workers (this one re-reads
+    # the new token on its next lookup)
+    _redis_set("generation", time.time(), ttl=None)
+    _generation_seen.pop(getattr(frappe.local, "site", None), None)
     # Also clear LangChain tools cache
     try:
         from niv_ai.niv_core.langchain.tools import clear_tools_cache
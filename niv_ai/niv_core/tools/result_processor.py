@@ -26,7 +26,7 @@ READ_ONLY_TOOLS = {
 }
 
 
-def post_process_result(tool_name: str, result_text: str) -> str:
+def post_process_result(tool_name: str, result_text: str, data=None) -> str:
     """Post-process a tool result to reduce token usage.
     
     Strategy:
@@ -38,6 +38,8 @@ def post_process_result(tool_name: str, result_text: str) -> str:
     Args:
         tool_name: Name of the tool that produced this result
         result_text: Raw result string from MCP tool
+        data: Already-parsed result that result_text was serialized from,
+              if the caller has it (skips re-parsing result_text)
         
     Returns:
         Processed result string (may be shorter than input)
@@ -57,6 +59,8 @@ def post_process_result(tool_name: str, result_text: str) -> str:
         return result_text
     
     # Try to parse as JSON for intelligent summarization
+    if data is not None:
+        return _summarize_json_result(tool_name, data)
     try:
         data = json.loads(result_text)
         return _summarize_json_result(tool_name, data)
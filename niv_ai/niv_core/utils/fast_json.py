@@ -0,0 +1,39 @@
+"""
+JSON helpers for hot paths (SSE frames, webhook payloads).
+Uses orjson when installed, stdlib json otherwise — output is compact either way.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj, indent=False, default=str):
+    """Serialize to UTF-8 bytes. Non-JSON types fall back to default (str);
+    with default=None they raise TypeError instead."""
+    if orjson is not None:
+        # Non-str keys (ints, dates) are stringified like stdlib json does
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(obj, default=default, option=option)
+        except TypeError:
+            # orjson rejects some values stdlib json handles (e.g. ints
+            # beyond 64 bits) — let stdlib json have a go
+            pass
+    if indent:
+        return json.dumps(obj, default=default, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(obj, default=default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(obj, indent=False):
+    """Serialize to str (for DB fields and Redis values)."""
+    return dumps(obj, indent=indent).decode("utf-8")
+
+
+def loads(data):
+    """Parse JSON from str or bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
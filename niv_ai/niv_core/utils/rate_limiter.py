@@ -1,10 +1,9 @@
 """
 Redis-based rate limiting for Niv AI API endpoints.
-Uses Frappe's Redis cache with sliding window counters.
+Uses Frappe's Redis cache with fixed-window INCR counters.
 """
 import frappe
-import time
-import math
+from niv_ai.niv_core.utils import get_niv_settings
 
 
 class RateLimitExceeded(Exception):
@@ -15,10 +14,10 @@ class RateLimitExceeded(Exception):
         super().__init__(message)
 
 
-def _get_limits():
+def _get_limits(settings=None):
     """Get rate limits from Niv Settings with defaults."""
     try:
-        settings = frappe.get_single("Niv Settings")
+        settings = settings or get_niv_settings()
         return {
             "per_minute": int(getattr(settings, "rate_limit_per_minute", 0) or 30),
             "per_hour": int(getattr(settings, "rate_limit_per_hour", 0) or 500),
@@ -34,63 +33,69 @@ def _get_cache():
     return frappe.cache()
 
 
-def check_rate_limit(user=None):
+def check_rate_limit(user=None, settings=None):
     """
     Check rate limits for a user or IP. Raises RateLimitExceeded if exceeded.
     
-    Uses Redis sorted sets with timestamp-based sliding windows.
+    Uses Redis INCR counters with a TTL per window (fixed windows), so each
+    check is O(1) no matter how many requests the user has made.
     """
     user = user or frappe.session.user
-    limits = _get_limits()
+    limits = _get_limits(settings)
     cache = _get_cache()
-    now = time.time()
 
     if user == "Guest":
         # IP-based limiting for guests
         ip = frappe.local.request.remote_addr if hasattr(frappe.local, "request") and frappe.request else "unknown"
-        key = f"niv_rate:ip:{ip}"
-        _check_window(cache, key, now, limits["guest_per_minute"], 60, "Too many requests. Please wait.")
+        _check_windows(cache, [
+            (f"niv_rl:ip:{ip}", limits["guest_per_minute"], 60, "Too many requests. Please wait."),
+        ])
         return
 
     # Per-user limits
-    windows = [
-        (f"niv_rate:user:{user}:min", limits["per_minute"], 60, "Rate limit exceeded. Please wait a moment."),
-        (f"niv_rate:user:{user}:hour", limits["per_hour"], 3600, "Hourly limit reached. Please try again later."),
-        (f"niv_rate:user:{user}:day", limits["per_day"], 86400, "Daily limit reached. Try again tomorrow."),
-    ]
+    _check_windows(cache, [
+        (f"niv_rl:user:{user}:min", limits["per_minute"], 60, "Rate limit exceeded. Please wait a moment."),
+        (f"niv_rl:user:{user}:hour", limits["per_hour"], 3600, "Hourly limit reached. Please try again later."),
+        (f"niv_rl:user:{user}:day", limits["per_day"], 86400, "Daily limit reached. Try again tomorrow."),
+    ])
+
+
+# INCR each window and start its TTL on the first hit, atomically: a crash
+# or error between a separate INCR and EXPIRE would leave a counter that
+# never resets. Returns a flat [count, ttl, count, ttl, ...] list.
+# (EXPIRE ... NX would do the same but needs Redis 7.)
+_INCR_WINDOWS_LUA = """
+local out = {}
+for i, key in ipairs(KEYS) do
+    local count = redis.call('INCR', key)
+    local ttl = redis.call('TTL', key)
+    if ttl < 0 then
+        ttl = tonumber(ARGV[i])
+        redis.call('EXPIRE', key, ttl)
+    end
+    out[#out + 1] = count
+    out[#out + 1] = ttl
+end
+return out
+"""
 
-    for key, limit, window, msg in windows:
-        _check_window(cache, key, now, limit, window, msg)
 
+def _check_windows(cache, windows):
+    """Count this request in every window with one script round-trip.
 
-def _check_window(cache, key, now, limit, window_seconds, message):
-    """Check a single sliding window rate limit using Redis."""
+    windows: list of (key, limit, window_seconds, message).
+    """
     try:
-        # Clean old entries and count current
-        window_start = now - window_seconds
-        
-        # Use pipeline for atomicity
-        pipe = cache.pipeline()
-        pipe.zremrangebyscore(key, 0, window_start)
-        pipe.zcard(key)
-        results = pipe.execute()
-        
-        count = results[1] if len(results) > 1 else 0
-
-        if count >= limit:
-            # Calculate retry-after from oldest entry in window
-            oldest = cache.zrange(key, 0, 0, withscores=True)
-            if oldest:
-                retry_after = max(1, int(oldest[0][1] + window_seconds - now))
-            else:
-                retry_after = int(window_seconds / 2)
-            raise RateLimitExceeded(message, retry_after=retry_after)
-
-        # Add current request
-        pipe2 = cache.pipeline()
-        pipe2.zadd(key, {str(now): now})
-        pipe2.expire(key, window_seconds + 10)
-        pipe2.execute()
+        results = cache.eval(
+            _INCR_WINDOWS_LUA, len(windows),
+            *[key for key, _limit, _window, _msg in windows],
+            *[window for _key, _limit, window, _msg in windows],
+        )
+
+        for i, (key, limit, window_seconds, message) in enumerate(windows):
+            count, ttl = int(results[2 * i]), int(results[2 * i + 1])
+            if count > limit:
+                raise RateLimitExceeded(message, retry_after=max(1, ttl))
 
     except RateLimitExceeded:
         raise
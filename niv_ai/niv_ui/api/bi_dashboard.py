@@ -143,7 +143,6 @@ def clear_ai_cache(period="this_year"):
 
 def _run_ai_analysis(job_key, running_key, period, user):
     """Background: AI agent queries + analyzes."""
-    import re
     frappe.set_user(user)
     
     prompt = f"""Analyze business data for period: {period}. Use run_database_query tool.
@@ -170,10 +169,12 @@ Return ONLY valid JSON."""
         
         result = {"source": "ai", "period": period, "raw": response_text, "status": "text"}
         if response_text:
-            json_match = re.search(r'\{[\s\S]*\}', response_text)
-            if json_match:
+            # First "{" to last "}" — same span as a greedy {...} regex, no backtracking
+            start = response_text.find("{")
+            end = response_text.rfind("}")
+            if start >= 0 and end > start:
                 try:
-                    result["data"] = json.loads(json_match.group())
+                    result["data"] = json.loads(response_text[start:end + 1])
                     result["status"] = "ok"
                 except: pass
         